@@ -3,57 +3,2516 @@ from toga.style import Pack
 from toga.style.pack import COLUMN, ROW
 import asyncio
 import aiohttp
+from aiohttp import web
+import array
+import collections
+import datetime
+import hashlib
+import heapq
+import hmac
+import io
 import json
+import math
+import mmap
 import os
+import secrets
+import struct
+import time
+import urllib.parse
 
-class XDripClient:
-    def __init__(self, base_urls=None):
+class Reading:
+    """A single glucose reading"""
+    __slots__ = ("timestamp", "value", "direction", "raw_data")
+
+    def __init__(self, timestamp, value, direction="Unknown", raw_data=None):
+        self.timestamp = timestamp
+        self.value = value
+        self.direction = direction
+        # The original payload, only kept when asked for
+        self.raw_data = raw_data
+
+    @property
+    def date_string(self):
+        """Get the reading time as an ISO 8601 string"""
+        return datetime.datetime.fromtimestamp(
+            self.timestamp / 1000, tz=datetime.timezone.utc
+        ).isoformat()
+
+    def __repr__(self):
+        return f"Reading({self.timestamp}, {self.value}, {self.direction!r})"
+
+class GlucoseHistory:
+    """Fixed-size ring buffer of readings, oldest first
+
+    Readings are stored in parallel typed arrays (timestamp, sgv and
+    direction code), about 11 bytes per reading.
+    """
+    DIRECTIONS = (
+        "Unknown", "NONE", "DoubleUp", "SingleUp", "FortyFiveUp", "Flat",
+        "FortyFiveDown", "SingleDown", "DoubleDown", "NOT COMPUTABLE", "RATE OUT OF RANGE",
+    )
+    DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+    # Readings dated further than this (seconds) in the future are refused,
+    # or a single bad timestamp would hide every real reading after it
+    MAX_FUTURE_SKEW = 120
+
+    def __init__(self, window=24 * 3600, min_reading_interval=60):
+        self.window = window
+        # Sized for the fastest sensors (one reading a minute)
+        self.capacity = int(window // min_reading_interval) + 1
+        self.timestamps = array.array("q", bytes(8 * self.capacity))
+        self.values = array.array("H", bytes(2 * self.capacity))
+        self.directions = array.array("b", bytes(self.capacity))
+        self.start = 0
+        self.size = 0
+        self._latest = None
+        # Optional HistoryLog that new readings are appended to
+        self.log = None
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return self.iter_window()
+
+    def _physical(self, index):
+        """Convert a logical index (0 = oldest) to an array index"""
+        return (self.start + index) % self.capacity
+
+    def get(self, index):
+        """Get the reading at a logical index (0 = oldest, -1 = newest)"""
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("history index out of range")
+        i = self._physical(index)
+        return Reading(self.timestamps[i], self.values[i], self.DIRECTIONS[self.directions[i]])
+
+    def latest(self):
+        """Get the newest reading, or None"""
+        if not self.size:
+            return None
+        if self._latest is None or self._latest.timestamp != self.latest_timestamp:
+            self._latest = self.get(-1)
+        return self._latest
+
+    @property
+    def latest_timestamp(self):
+        """Get the newest reading's timestamp in ms, or None"""
+        return self.timestamps[self._physical(self.size - 1)] if self.size else None
+
+    def _append_record(self, timestamp, value, direction_code):
+        """Add a record at the newest end, overwriting the oldest when full"""
+        i = self._physical(self.size)
+        self.timestamps[i] = timestamp
+        self.values[i] = value
+        self.directions[i] = direction_code
+        if self.size == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.size += 1
+
+    def append(self, reading):
+        """Add a reading at the newest end, overwriting the oldest when full"""
+        self._append_record(
+            reading.timestamp,
+            max(0, min(int(reading.value), 0xFFFF)),
+            self.DIRECTION_CODES.get(reading.direction, 0),
+        )
+        # Keep the caller's object (and its raw payload, if any) for latest()
+        self._latest = reading
+
+    def get_timestamp_limit(self, now_ms=None):
+        """Get the newest timestamp (ms) a reading may have"""
+        if now_ms is None:
+            now_ms = time.time() * 1000
+        return now_ms + self.MAX_FUTURE_SKEW * 1000
+
+    def load_records(self, records):
+        """Add (timestamp, value, direction code) records, oldest first. Returns how many were added"""
+        limit = self.get_timestamp_limit()
+        added = 0
+        for timestamp, value, direction_code in records:
+            if self.size and timestamp <= self.latest_timestamp:
+                continue
+            if timestamp > limit:
+                continue
+            self._append_record(timestamp, value, direction_code)
+            added += 1
+        self._trim()
+        return added
+
+    def merge(self, readings, now_ms=None):
+        """Add readings newer than the newest we have. Returns how many were added
+
+        Readings dated in the future (beyond MAX_FUTURE_SKEW) are dropped.
+        """
+        latest_timestamp = self.latest_timestamp
+        limit = self.get_timestamp_limit(now_ms)
+        new_readings = sorted(
+            (reading for reading in readings
+             if (latest_timestamp is None or reading.timestamp > latest_timestamp)
+             and reading.timestamp <= limit),
+            key=lambda reading: reading.timestamp
+        )
+        for reading in new_readings:
+            self.append(reading)
+        self._trim()
+        if self.log is not None and new_readings:
+            try:
+                self.log.append(new_readings)
+            except Exception as e:
+                print(f"Error saving glucose history: {e}")
+        return len(new_readings)
+
+    def _trim(self):
+        """Drop readings that fell out of the time window"""
+        if not self.size:
+            return
+        cutoff = self.latest_timestamp - self.window * 1000
+        while self.size and self.timestamps[self.start] < cutoff:
+            self.start = (self.start + 1) % self.capacity
+            self.size -= 1
+
+    def _first_index_after(self, timestamp_ms):
+        """Binary search for the first logical index newer than timestamp_ms"""
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._physical(middle)] > timestamp_ms:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def window_segments(self, since_ms=None):
+        """Get zero-copy views of the readings newer than since_ms
+
+        Returns up to two (timestamps, values, directions) memoryview triples,
+        oldest first, since the window may wrap around the end of the arrays.
+        """
+        first = 0 if since_ms is None else self._first_index_after(since_ms)
+        count = self.size - first
+        if count <= 0:
+            return []
+        begin = self._physical(first)
+        spans = [(begin, min(begin + count, self.capacity))]
+        if begin + count > self.capacity:
+            spans.append((0, begin + count - self.capacity))
+        timestamps = memoryview(self.timestamps)
+        values = memoryview(self.values)
+        directions = memoryview(self.directions)
+        return [
+            (timestamps[low:high], values[low:high], directions[low:high])
+            for low, high in spans
+        ]
+
+    def iter_window(self, since_ms=None):
+        """Iterate (timestamp, value, direction code) newer than since_ms, oldest first"""
+        for timestamps, values, directions in self.window_segments(since_ms):
+            yield from zip(timestamps, values, directions)
+
+    def since(self, timestamp_ms):
+        """Get the readings newer than the given timestamp, oldest first"""
+        return [
+            Reading(timestamp, value, self.DIRECTIONS[direction])
+            for timestamp, value, direction in self.iter_window(timestamp_ms)
+        ]
+
+class HistoryLog:
+    """Append-only binary file of fixed-size reading records
+
+    Each reading is one 12 byte record appended to the file. At startup the
+    file is memory-mapped and only the records inside the history window are
+    read (found by binary search), so restoring doesn't get slower as the
+    file grows. Once the file spans COMPACT_SLACK times the retention period
+    it's rewritten without the records older than that period.
+    """
+    MAGIC = b"DBGH"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHH")
+    RECORD = struct.Struct("<qHbx")  # timestamp ms, sgv, direction code
+    # Only compact once the file holds this much more than the retention
+    # period, so a restore doesn't rewrite the file every time
+    COMPACT_SLACK = 1.25
+
+    def __init__(self, path, retention=30 * 24 * 3600):
+        self.path = path
+        self.retention = retention
+        self.file = None
+        # Timestamp of the first record in the file, read when it's opened
+        self.oldest_timestamp = None
+
+    def _open_for_append(self):
+        """Open the file for appending, creating it or fixing a torn last record
+
+        A file with a header from another format or version is started over.
+        """
+        if self.file is not None:
+            return self.file
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "a+b")
+        size = self.file.seek(0, os.SEEK_END)
+        self.file.seek(0)
+        header = self.file.read(self.HEADER.size)
+        if not self._is_valid(header):
+            if size:
+                print("Starting a new glucose history file in place of an unreadable one")
+            self.file.truncate(0)
+            size = 0
+        if size < self.HEADER.size:
+            self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size))
+        else:
+            extra = (size - self.HEADER.size) % self.RECORD.size
+            if extra:
+                # A crash left a partial record at the end
+                self.file.truncate(size - extra)
+            if size - extra > self.HEADER.size:
+                self.file.seek(self.HEADER.size)
+                self.oldest_timestamp = self.RECORD.unpack(self.file.read(self.RECORD.size))[0]
+        self.file.flush()
+        return self.file
+
+    def append(self, readings):
+        """Append readings (oldest first) in a single write"""
+        if not readings:
+            return
+        data = b"".join(
+            self.RECORD.pack(
+                reading.timestamp,
+                max(0, min(int(reading.value), 0xFFFF)),
+                GlucoseHistory.DIRECTION_CODES.get(reading.direction, 0),
+            )
+            for reading in readings
+        )
+        file = self._open_for_append()
+        file.write(data)
+        file.flush()
+        if self.oldest_timestamp is None:
+            self.oldest_timestamp = readings[0].timestamp
+        # Drop old records while running too, not only at startup
+        if readings[-1].timestamp - self.oldest_timestamp > self.COMPACT_SLACK * self.retention * 1000:
+            self.compact()
+
+    def _record_count(self, mapped):
+        return (len(mapped) - self.HEADER.size) // self.RECORD.size
+
+    def _timestamp_at(self, mapped, index):
+        return self.RECORD.unpack_from(mapped, self.HEADER.size + index * self.RECORD.size)[0]
+
+    def _first_index_at_or_after(self, mapped, timestamp_ms):
+        """Binary search the records for the first one at or after timestamp_ms"""
+        low, high = 0, self._record_count(mapped)
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp_at(mapped, middle) < timestamp_ms:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _is_valid(self, mapped):
+        if len(mapped) < self.HEADER.size:
+            return False
+        magic, version, record_size = self.HEADER.unpack_from(mapped, 0)
+        return magic == self.MAGIC and version == self.VERSION and record_size == self.RECORD.size
+
+    def restore(self, history):
+        """Load the readings inside the history window into history"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= self.HEADER.size:
+            return 0
+        with open(self.path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if not self._is_valid(mapped):
+                    print("Ignoring unreadable glucose history file")
+                    return 0
+                count = self._record_count(mapped)
+                if not count:
+                    return 0
+                newest = self._timestamp_at(mapped, count - 1)
+                first = self._first_index_at_or_after(mapped, newest - history.window * 1000)
+                start = self.HEADER.size + first * self.RECORD.size
+                end = self.HEADER.size + count * self.RECORD.size
+                restored = history.load_records(self.RECORD.iter_unpack(mapped[start:end]))
+                needs_compaction = self._timestamp_at(mapped, 0) < newest - self.COMPACT_SLACK * self.retention * 1000
+        if needs_compaction:
+            self.compact()
+        return restored
+
+    def compact(self):
+        """Rewrite the file keeping only readings inside the retention period"""
+        self.close()
+        try:
+            with open(self.path, "rb") as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    count = self._record_count(mapped)
+                    if not self._is_valid(mapped) or not count:
+                        return
+                    newest = self._timestamp_at(mapped, count - 1)
+                    first = self._first_index_at_or_after(mapped, newest - self.retention * 1000)
+                    start = self.HEADER.size + first * self.RECORD.size
+                    end = self.HEADER.size + count * self.RECORD.size
+                    kept = mapped[start:end]
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as file:
+                file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size))
+                file.write(kept)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"Error compacting glucose history: {e}")
+
+    def close(self):
+        """Close the append handle"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.oldest_timestamp = None
+
+class PushReceiver:
+    """Local Nightscout-style endpoint that xDrip+ can upload readings to
+
+    In xDrip+, enable Cloud Upload > Nightscout Sync (REST-API) with the
+    base URL http://secret@127.0.0.1:17581/api/v1/ and readings are pushed
+    here as soon as they arrive, instead of waiting for the next poll.
+    A secret is required, uploads without it are refused.
+    """
+    def __init__(self, on_readings, port=17581, host="127.0.0.1", api_secret=""):
+        # on_readings(readings) is called with the readings from each upload
+        self.on_readings = on_readings
+        self.port = port
+        self.host = host
+        self.api_secret = api_secret
+        self.runner = None
+        self.last_push_time = None
+        self.stats = {"uploads": 0, "readings": 0, "rejected": 0}
+
+    @property
+    def is_running(self):
+        return self.runner is not None
+
+    def _is_authorized(self, request):
+        """Check the api-secret header (the SHA1 hex digest of the secret, as xDrip+ sends it)"""
+        if not self.api_secret:
+            return False
+        expected = hashlib.sha1(self.api_secret.encode("utf-8")).hexdigest()
+        provided = request.headers.get("api-secret", "").lower()
+        return hmac.compare_digest(provided.encode("utf-8"), expected.encode("utf-8"))
+
+    @staticmethod
+    def _parse_entries(payload):
+        """Convert uploaded Nightscout entries to readings, ignoring non-sgv entries"""
+        entries = payload if isinstance(payload, list) else [payload]
+        readings = []
+        for entry in entries:
+            if not isinstance(entry, dict) or entry.get('type', 'sgv') != 'sgv':
+                continue
+            if 'sgv' not in entry or 'date' not in entry:
+                continue
+            # A value that isn't a number fails the whole upload with a 400
+            readings.append(Reading(int(entry['date']), int(entry['sgv']), entry.get('direction', 'Unknown')))
+        return readings
+
+    async def _handle_entries(self, request):
+        if not self._is_authorized(request):
+            self.stats["rejected"] += 1
+            return web.json_response({"message": "Unauthorized"}, status=401)
+        try:
+            readings = self._parse_entries(await request.json())
+        except Exception:
+            self.stats["rejected"] += 1
+            return web.json_response({"message": "Invalid entries"}, status=400)
+
+        self.stats["uploads"] += 1
+        self.stats["readings"] += len(readings)
+        self.last_push_time = time.time()
+        if readings:
+            try:
+                await self.on_readings(readings)
+            except Exception as e:
+                print(f"Error handling pushed readings: {e}")
+        return web.json_response([{"ok": 1}])
+
+    async def _handle_other(self, request):
+        # Accept (and ignore) the other uploads xDrip+ makes so it doesn't retry them
+        return web.json_response([])
+
+    async def _handle_status(self, request):
+        return web.json_response({"status": "ok", "name": "Diabuddy Bulb", "apiEnabled": True})
+
+    def is_receiving(self, max_age):
+        """Check if a reading upload arrived in the last max_age seconds"""
+        return self.last_push_time is not None and time.time() - self.last_push_time < max_age
+
+    async def start(self):
+        """Start listening in the current event loop"""
+        if self.runner is not None:
+            return
+        if not self.api_secret:
+            raise ValueError("Push receiver needs an API secret")
+        app = web.Application()
+        app.router.add_post("/api/v1/entries", self._handle_entries)
+        app.router.add_post("/api/v1/entries.json", self._handle_entries)
+        app.router.add_get("/api/v1/status.json", self._handle_status)
+        app.router.add_post("/api/v1/{other:.*}", self._handle_other)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except Exception:
+            await runner.cleanup()
+            raise
+        self.runner = runner
+
+    async def stop(self):
+        """Stop listening"""
+        runner, self.runner = self.runner, None
+        if runner is not None:
+            await runner.cleanup()
+
+class TrendPrediction:
+    """Result of a trend fit over recent readings"""
+    __slots__ = ("slope", "value", "predicted_value", "lead_time", "points")
+
+    def __init__(self, slope, value, predicted_value, lead_time, points):
+        # mg/dL per minute, fitted current value and value lead_time minutes ahead
+        self.slope = slope
+        self.value = value
+        self.predicted_value = predicted_value
+        self.lead_time = lead_time
+        self.points = points
+
+class TrendPredictor:
+    """Least-squares trend fit over the last readings in the history
+
+    A single pass over a handful of points from the history arrays, so a
+    fit takes around ten microseconds (tools/bench_trend_fit.py).
+    """
+    def __init__(self, fit_window=25, min_points=3, max_points=6, max_age=15):
+        self.fit_window = fit_window
+        self.min_points = min_points
+        self.max_points = max_points
+        # Don't extrapolate from readings that are too old
+        self.max_age = max_age
+
+    def fit(self, history, lead_time=15, now_ms=None):
+        """Fit the readings in the last fit_window minutes, or None if there are too few"""
+        latest_timestamp = history.latest_timestamp
+        if latest_timestamp is None:
+            return None
+        if now_ms is not None and now_ms - latest_timestamp > self.max_age * 60000:
+            return None
+
+        since = latest_timestamp - self.fit_window * 60000
+        points = list(history.iter_window(since))[-self.max_points:]
+        n = len(points)
+        if n < self.min_points:
+            return None
+
+        # x is minutes relative to the latest reading
+        sum_x = sum_y = sum_xx = sum_xy = 0.0
+        for timestamp, value, _ in points:
+            x = (timestamp - latest_timestamp) / 60000
+            sum_x += x
+            sum_y += value
+            sum_xx += x * x
+            sum_xy += x * value
+        denominator = n * sum_xx - sum_x * sum_x
+        if denominator == 0:
+            return None
+        slope = (n * sum_xy - sum_x * sum_y) / denominator
+        value = (sum_y - slope * sum_x) / n
+        return TrendPrediction(slope, value, value + slope * lead_time, lead_time, n)
+
+class AlertClassifier:
+    """Stabilizes alert levels so readings near a threshold don't flap
+
+    Moving to a more urgent level happens immediately. Moving back to a less
+    urgent one needs the value to be past the threshold by the hysteresis
+    margin and the current level to have lasted at least min_dwell minutes.
+    Values can optionally be smoothed with an exponential moving average.
+    """
+    def __init__(self, level_for, band_order, urgency, margin=3, min_dwell=10, smoothing=0.0):
+        # level_for(value) -> level, band_order[level] sorts levels by glucose
+        # value and urgency[level] by how serious they are
+        self.level_for = level_for
+        self.band_order = band_order
+        self.urgency = urgency
+        self.margin = margin
+        self.min_dwell = min_dwell
+        # Weight of the previous smoothed value, 0 turns smoothing off
+        self.smoothing = smoothing
+        self.stats = {"changes": 0, "suppressed": 0}
+        self.reset()
+
+    def reset(self):
+        """Forget the current level, e.g. after the thresholds changed"""
+        self.level = None
+        self.level_since = None
+        self.smoothed_value = None
+        self.last_timestamp = None
+
+    def smooth(self, value, timestamp_ms):
+        """Get the smoothed value, restarting after a long gap between readings"""
+        if (not self.smoothing or self.smoothed_value is None or self.last_timestamp is None
+                or timestamp_ms - self.last_timestamp > 15 * 60000):
+            self.smoothed_value = value
+        else:
+            self.smoothed_value = self.smoothing * self.smoothed_value + (1 - self.smoothing) * value
+        self.last_timestamp = timestamp_ms
+        return self.smoothed_value
+
+    def update(self, candidate, value, timestamp_ms):
+        """Get the level to show, given the level the latest reading points to"""
+        if self.level is None or candidate == self.level:
+            if self.level is None:
+                self.level_since = timestamp_ms
+            self.level = candidate
+            return self.level
+
+        if self.urgency[candidate] < self.urgency[self.level]:
+            # The value must clear the boundary by the margin...
+            if self.band_order[candidate] > self.band_order[self.level]:
+                shifted = value - self.margin
+            else:
+                shifted = value + self.margin
+            if self.level_for(shifted) == self.level:
+                self.stats["suppressed"] += 1
+                return self.level
+            # ...and the current level must have lasted long enough
+            if timestamp_ms - self.level_since < self.min_dwell * 60000:
+                self.stats["suppressed"] += 1
+                return self.level
+
+        self.stats["changes"] += 1
+        self.level = candidate
+        self.level_since = timestamp_ms
+        return self.level
+
+class Band:
+    """A glucose range and how the bulb and app show it"""
+    __slots__ = ("name", "lower", "hue", "saturation", "brightness", "icon", "urgency", "label", "effect")
+
+    def __init__(self, name, lower, hue, saturation=100, brightness=None, icon="icon_ready.png",
+                 urgency=0, label=None, effect=None):
+        self.name = name
+        # Lowest value in the band in mg/dL (None for the bottom band)
+        self.lower = lower
+        self.hue = hue
+        self.saturation = saturation
+        # None leaves the bulb brightness as it is
+        self.brightness = brightness
+        self.icon = icon
+        # 0 is in range, higher numbers are more serious
+        self.urgency = urgency
+        # Shown when there's no translation for the band name
+        self.label = label
+        # Name of a BulbEffects effect ("flash", "pulse") shown instead of a steady color
+        self.effect = effect
+
+class BandTable:
+    """Band lookup table, compiled once from the band settings
+
+    table[int(mg/dL)] is the index of the band for that value, so
+    classifying a reading is a single index operation.
+    """
+    MAX_VALUE = 600
+    MGDL_PER_MMOL = 18.0182
+    # Where the gradient puts the color of an open-ended top or bottom band
+    GRADIENT_EDGE = 10
+
+    def __init__(self, bands):
+        self.bands = sorted(bands, key=lambda band: -1 if band.lower is None else band.lower)
+        self.by_name = {band.name: band for band in self.bands}
+        self.order = {band.name: index for index, band in enumerate(self.bands)}
+        self.urgency = {band.name: band.urgency for band in self.bands}
+        self.table = array.array("B", bytes(self.MAX_VALUE + 1))
+        for index, band in enumerate(self.bands):
+            start = max(0, int(math.ceil(band.lower))) if band.lower is not None else 0
+            for value in range(start, self.MAX_VALUE + 1):
+                self.table[value] = index
+        self._compile_gradient()
+
+    def _compile_gradient(self):
+        """Compile hue and saturation per mg/dL, blending between band centers"""
+        anchors = []
+        for index, band in enumerate(self.bands):
+            upper = self.bands[index + 1].lower if index + 1 < len(self.bands) else None
+            if band.lower is None and upper is None:
+                center = self.MAX_VALUE / 2
+            elif band.lower is None:
+                center = max(0, upper - self.GRADIENT_EDGE)
+            elif upper is None:
+                center = min(self.MAX_VALUE, band.lower + self.GRADIENT_EDGE)
+            else:
+                center = (band.lower + upper) / 2
+            anchors.append((center, band.hue % 360, band.saturation))
+
+        self.gradient_hue = array.array("H", bytes(2 * (self.MAX_VALUE + 1)))
+        self.gradient_saturation = array.array("B", bytes(self.MAX_VALUE + 1))
+        position = 0
+        for value in range(self.MAX_VALUE + 1):
+            while position + 1 < len(anchors) and anchors[position + 1][0] <= value:
+                position += 1
+            center, hue, saturation = anchors[position]
+            if value > center and position + 1 < len(anchors):
+                next_center, next_hue, next_saturation = anchors[position + 1]
+                fraction = (value - center) / (next_center - center)
+                # Go the short way round the color wheel
+                delta = (next_hue - hue + 180) % 360 - 180
+                hue = (hue + delta * fraction) % 360
+                saturation = saturation + (next_saturation - saturation) * fraction
+            self.gradient_hue[value] = int(round(hue)) % 360
+            self.gradient_saturation[value] = int(round(saturation))
+
+    @classmethod
+    def from_thresholds(cls, critical_low, low, high):
+        """Build the standard four bands from the threshold settings"""
+        return cls([
+            Band("critical", None, 0, 100, icon="icon_critical.png", urgency=3, effect="flash"),  # Red
+            Band("low", critical_low, 270, 100, icon="icon_low.png", urgency=2),     # Light Pink
+            Band("normal", low, 120, 100, icon="icon_normal.png", urgency=0),        # Green
+            Band("high", high + 1, 60, 100, icon="icon_high.png", urgency=1),        # Yellow
+        ])
+
+    @classmethod
+    def from_settings(cls, band_settings, units="mg/dL"):
+        """Build user-defined bands, with lower bounds in mg/dL or mmol/L"""
+        scale = cls.MGDL_PER_MMOL if units == "mmol/L" else 1
+        bands = []
+        for band in band_settings:
+            lower = band.get("lower")
+            if lower is not None and scale != 1:
+                lower = cls._mmol_to_lower_bound(lower)
+            bands.append(Band(
+                band["name"],
+                lower,
+                band.get("hue", 120),
+                band.get("saturation", 100),
+                band.get("brightness"),
+                band.get("icon", "icon_ready.png"),
+                band.get("urgency", 0),
+                band.get("label"),
+                band.get("effect"),
+            ))
+        if not bands:
+            raise ValueError("No glucose bands defined")
+        return cls(bands)
+
+    @classmethod
+    def _mmol_to_lower_bound(cls, lower):
+        """Convert a mmol/L lower bound to the first whole mg/dL shown as at least that"""
+        mgdl = int(round(lower * cls.MGDL_PER_MMOL))
+        # 0.1 mmol/L is almost 2 mg/dL, so the value below may show the same
+        while mgdl > 0 and round((mgdl - 1) / cls.MGDL_PER_MMOL, 1) >= lower:
+            mgdl -= 1
+        return mgdl
+
+    def band_for(self, value):
+        """Get the band for a value in mg/dL"""
+        index = int(value)
+        if index < 0:
+            index = 0
+        elif index > self.MAX_VALUE:
+            index = self.MAX_VALUE
+        return self.bands[self.table[index]]
+
+    def level_for(self, value):
+        """Get the band name for a value in mg/dL"""
+        return self.band_for(value).name
+
+    def gradient_color(self, value):
+        """Get the (hue, saturation) blended between the band colors for a value in mg/dL"""
+        index = int(value)
+        if index < 0:
+            index = 0
+        elif index > self.MAX_VALUE:
+            index = self.MAX_VALUE
+        return self.gradient_hue[index], self.gradient_saturation[index]
+
+    @property
+    def thresholds(self):
+        """Get the band boundaries in mg/dL"""
+        return [band.lower for band in self.bands if band.lower is not None]
+
+    @property
+    def normal_range(self):
+        """Get the (lowest, highest) mg/dL of the in-range band(s)"""
+        lowest = highest = None
+        for index, band in enumerate(self.bands):
+            if band.urgency == 0:
+                upper = self.bands[index + 1].lower - 1 if index + 1 < len(self.bands) else self.MAX_VALUE
+                lowest = band.lower or 0 if lowest is None else lowest
+                highest = upper
+        return lowest, highest
+
+class GlucoseDataSource:
+    """Base class for places glucose readings come from
+
+    Subclasses implement get_latest_glucose(). Sources that can push
+    updates set supports_streaming and implement stream().
+    """
+    supports_streaming = False
+
+    def __init__(self, history=None, keepalive_timeout=340):
+        # Readings fetched so far; only newer ones are requested
+        self.history = history if history is not None else GlucoseHistory()
+        # Keep idle connections alive until the next reading's poll so it can
+        # reuse them instead of reconnecting. The default covers one 5 minute
+        # reading plus some slack; the app derives it from its scheduler
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+        }
+
+    @property
+    def is_streaming(self):
+        """Check if updates are currently arriving without polling"""
+        return False
+
+    def _create_trace_config(self):
+        """Count new and reused pooled connections"""
+        async def on_connection_create_end(session, context, params):
+            self.stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.stats["connections_reused"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def _create_connector(self):
+        return aiohttp.TCPConnector(
+            limit=4,
+            limit_per_host=2,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+
+    def get_session(self):
+        """Get the shared HTTP session, opening it on first use"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=self._create_connector(),
+                trace_configs=[self._create_trace_config()],
+            )
+        return self.session
+
+    async def close(self):
+        """Close the shared HTTP session and its pooled connections"""
+        session, self.session = self.session, None
+        if session is not None and not session.closed:
+            await session.close()
+
+    def get_stats(self):
+        """Get request and connection reuse statistics"""
+        stats = dict(self.stats)
+        connections = stats["connections_created"] + stats["connections_reused"]
+        stats["reuse_ratio"] = stats["connections_reused"] / connections if connections else 0.0
+        return stats
+
+    async def get_latest_glucose(self):
+        """Get the latest reading, or None if the source can't be reached"""
+        raise NotImplementedError
+
+    async def stream(self, on_readings):
+        """Pass new readings to on_readings as they arrive. Runs until cancelled"""
+        raise NotImplementedError
+
+class XDripClient(GlucoseDataSource):
+    def __init__(self, base_urls=None, keepalive_timeout=340, fetch_deadline=5,
+                 hedge_delay=0.25, latency_alpha=0.3, history=None, keep_raw=False):
+        super().__init__(history=history, keepalive_timeout=keepalive_timeout)
         self.base_urls = base_urls or [
             "http://127.0.0.1:17580",
-            "http://localhost:17580", 
+            "http://localhost:17580",
             "http://10.0.2.2:17580",
         ]
-    
+        self.keep_raw = keep_raw
+        # Endpoint selection: one overall deadline per fetch, a short head
+        # start for the last endpoint that worked, then race the others
+        self.fetch_deadline = fetch_deadline
+        self.hedge_delay = hedge_delay
+        self.latency_alpha = latency_alpha
+        self.preferred_url = None
+        self.endpoint_latency = {}
+        self.stats.update({
+            "not_modified": 0,
+            "unchanged_bodies": 0,
+            "json_decodes": 0,
+            "bytes_received": 0,
+            "bytes_decoded": 0,
+        })
+        # What each endpoint supports, learned from its responses, plus the
+        # validators from its last full response
+        self.endpoint_features = {}
+
+    def _create_connector(self):
+        return aiohttp.TCPConnector(
+            limit=len(self.base_urls) * 2,
+            limit_per_host=2,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+
+    def get_stats(self):
+        """Get request, connection reuse and endpoint statistics"""
+        stats = super().get_stats()
+        stats["preferred_url"] = self.preferred_url
+        stats["endpoint_latency"] = dict(self.endpoint_latency)
+        stats["endpoint_features"] = {
+            base_url: {"conditional": features["conditional"], "gzip": features["gzip"]}
+            for base_url, features in self.endpoint_features.items()
+        }
+        return stats
+
+    def _ordered_endpoints(self):
+        """Get endpoints ordered by preference and measured latency"""
+        ordered = sorted(
+            self.base_urls,
+            key=lambda url: self.endpoint_latency.get(url, float("inf"))
+        )
+        if self.preferred_url in ordered:
+            ordered.remove(self.preferred_url)
+            ordered.insert(0, self.preferred_url)
+        return ordered
+
+    def _record_latency(self, base_url, latency):
+        """Update the moving average latency for an endpoint"""
+        previous = self.endpoint_latency.get(base_url)
+        if previous is None:
+            self.endpoint_latency[base_url] = latency
+        else:
+            alpha = self.latency_alpha
+            self.endpoint_latency[base_url] = alpha * latency + (1 - alpha) * previous
+
+    def _get_fetch_count(self):
+        """Get how many readings to ask for to cover the gap since the last one"""
+        latest_timestamp = self.history.latest_timestamp
+        if latest_timestamp is None:
+            return self.history.capacity
+        gap = time.time() - latest_timestamp / 1000
+        # Assume the fastest sensor cadence so no reading is missed
+        missing = int(gap // 60) + 2
+        return max(2, min(missing, self.history.capacity))
+
+    def _parse_reading(self, entry):
+        """Convert an sgv.json entry to a reading"""
+        return Reading(
+            entry['date'],
+            entry['sgv'],
+            entry.get('direction', 'Unknown'),
+            entry if self.keep_raw else None
+        )
+
+    def _get_request_headers(self, features, count):
+        """Build compression and conditional request headers for an endpoint"""
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        # Validators are only valid for the same query
+        if features["conditional"] is not False and features["count"] == count:
+            if features["etag"]:
+                headers["If-None-Match"] = features["etag"]
+            if features["last_modified"]:
+                headers["If-Modified-Since"] = features["last_modified"]
+        return headers
+
+    async def _fetch_from(self, session, base_url, count):
+        """Fetch the most recent readings from a single endpoint
+
+        Returns a list of readings, an empty list if nothing changed since
+        the last fetch, or None if the endpoint failed.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        features = self.endpoint_features.setdefault(base_url, {
+            "conditional": None,
+            "gzip": None,
+            "etag": None,
+            "last_modified": None,
+            "count": None,
+            "body_hash": None,
+        })
+        try:
+            self.stats["requests"] += 1
+            headers = self._get_request_headers(features, count)
+            async with session.get(f"{base_url}/sgv.json", params={"count": count}, headers=headers) as response:
+                if response.status == 304:
+                    self._record_latency(base_url, loop.time() - started)
+                    features["conditional"] = True
+                    self.stats["not_modified"] += 1
+                    return []
+                if response.status == 200:
+                    body = await response.read()
+                    self._record_latency(base_url, loop.time() - started)
+
+                    # content_length is the size on the wire, before decompression
+                    self.stats["bytes_received"] += response.content_length or len(body)
+                    features["gzip"] = response.headers.get("Content-Encoding", "") in ("gzip", "deflate")
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    if "If-None-Match" in headers or "If-Modified-Since" in headers:
+                        # A full response to an unchanged conditional request means it's ignored
+                        if etag == features["etag"] and last_modified == features["last_modified"]:
+                            features["conditional"] = False
+                    elif features["conditional"] is None and (etag or last_modified):
+                        features["conditional"] = True
+                    features["etag"] = etag
+                    features["last_modified"] = last_modified
+                    features["count"] = count
+
+                    # Without server support, still skip decoding an identical body
+                    body_hash = hashlib.sha1(body).digest()
+                    if body_hash == features["body_hash"] and self.history.latest() is not None:
+                        self.stats["unchanged_bodies"] += 1
+                        return []
+                    features["body_hash"] = body_hash
+
+                    self.stats["json_decodes"] += 1
+                    self.stats["bytes_decoded"] += len(body)
+                    data = json.loads(body)
+                    if data and len(data) > 0:
+                        # Local cutoff in case the server ignores count
+                        latest_timestamp = self.history.latest_timestamp or 0
+                        return [
+                            self._parse_reading(entry)
+                            for entry in data
+                            if entry.get('date', 0) > latest_timestamp or entry is data[0]
+                        ]
+        except asyncio.CancelledError:
+            # Lost the race or ran out of time, count it as a slow response.
+            # The time until cancelling only says it was slower than the winner
+            self._record_latency(base_url, self.fetch_deadline)
+            raise
+        except Exception:
+            pass
+        # Failed endpoints are pushed to the back of the ordering
+        self._record_latency(base_url, self.fetch_deadline)
+        if self.preferred_url == base_url:
+            self.preferred_url = None
+        return None
+
+    async def get_latest_glucose(self):
+        """Get the latest glucose reading from xDrip+
+
+        The preferred endpoint gets a short head start, after which the
+        remaining endpoints are raced against it. The whole fetch is bounded
+        by a single deadline.
+        """
+        session = self.get_session()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.fetch_deadline
+
+        count = self._get_fetch_count()
+        endpoints = self._ordered_endpoints()
+        pending = {asyncio.create_task(self._fetch_from(session, endpoints[0], count)): endpoints[0]}
+        waiting = endpoints[1:]
+
+        try:
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                if waiting:
+                    timeout = min(timeout, self.hedge_delay)
+
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    base_url = pending.pop(task)
+                    readings = task.result()
+                    if readings is not None:
+                        self.preferred_url = base_url
+                        self.history.merge(readings)
+                        return self.history.latest()
+
+                # Head start is over (or the preferred endpoint failed), race the rest
+                for base_url in waiting:
+                    pending[asyncio.create_task(self._fetch_from(session, base_url, count))] = base_url
+                waiting = []
+        finally:
+            for task in pending:
+                task.cancel()
+        return None
+
+class NightscoutClient(GlucoseDataSource):
+    """Reads glucose from a Nightscout-compatible server
+
+    Updates are streamed over the server's socket.io channel; REST paging
+    of /api/v1/entries is used for catching up and as the fallback.
+    """
+    supports_streaming = True
+
+    # Engine.IO defaults for how often the server pings and how long it waits
+    PING_INTERVAL = 25000
+    PING_TIMEOUT = 20000
+
+    def __init__(self, url, api_secret="", history=None, page_size=288, fetch_timeout=10,
+                 reconnect_delay=5, max_reconnect_delay=300, keepalive_timeout=340):
+        super().__init__(history=history, keepalive_timeout=keepalive_timeout)
+        # A token can be given in the URL, e.g. https://ns.example.com/?token=reader-abc
+        parts = urllib.parse.urlsplit(url.strip())
+        query = urllib.parse.parse_qs(parts.query)
+        self.token = query.get("token", [""])[0]
+        self.url = urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path.rstrip("/"), "", ""))
+        self.api_secret = api_secret
+        self.page_size = page_size
+        self.fetch_timeout = fetch_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.streaming = False
+        self.stats.update({
+            "pages": 0,
+            "stream_connects": 0,
+            "stream_updates": 0,
+            "stream_timeouts": 0,
+        })
+
+    @property
+    def is_streaming(self):
+        return self.streaming
+
+    def _hashed_secret(self):
+        return hashlib.sha1(self.api_secret.encode("utf-8")).hexdigest() if self.api_secret else None
+
+    def _auth_headers(self):
+        secret = self._hashed_secret()
+        return {"api-secret": secret} if secret else {}
+
+    def _auth_params(self):
+        return {"token": self.token} if self.token else {}
+
+    @staticmethod
+    def _parse_entry(entry):
+        """Convert a REST entry or a socket.io sgv to a reading, or None"""
+        if not isinstance(entry, dict) or entry.get("type", "sgv") != "sgv":
+            return None
+        value = entry.get("sgv", entry.get("mgdl"))
+        timestamp = entry.get("date", entry.get("mills"))
+        if value is None or timestamp is None:
+            return None
+        return Reading(int(timestamp), value, entry.get("direction", "Unknown"))
+
     async def get_latest_glucose(self):
-        """Get the latest glucose reading from xDrip+"""
-        for base_url in self.base_urls:
+        """Fetch readings newer than the last one we have, page by page"""
+        session = self.get_session()
+        latest_timestamp = self.history.latest_timestamp
+        readings = []
+        older_than = None
+        try:
+            while True:
+                params = {"count": self.page_size, **self._auth_params()}
+                if latest_timestamp is not None:
+                    params["find[date][$gt]"] = latest_timestamp
+                if older_than is not None:
+                    params["find[date][$lt]"] = older_than
+
+                self.stats["requests"] += 1
+                async with session.get(
+                    f"{self.url}/api/v1/entries/sgv.json",
+                    params=params,
+                    headers=self._auth_headers(),
+                    timeout=aiohttp.ClientTimeout(total=self.fetch_timeout),
+                ) as response:
+                    if response.status != 200:
+                        raise ValueError(f"HTTP {response.status}")
+                    page = await response.json()
+                self.stats["pages"] += 1
+
+                page_readings = [reading for reading in map(self._parse_entry, page) if reading]
+                readings.extend(page_readings)
+                if len(page) < self.page_size or not page_readings:
+                    break
+                # Entries come newest first; stop once the window is covered
+                older_than = min(reading.timestamp for reading in page_readings)
+                newest = max(reading.timestamp for reading in readings)
+                if older_than < newest - self.history.window * 1000:
+                    break
+        except Exception as e:
+            print(f"Error fetching from Nightscout: {e}")
+            if not readings:
+                return None
+
+        if not readings and self.history.latest() is None:
+            return None
+        self.history.merge(readings)
+        return self.history.latest()
+
+    async def stream(self, on_readings):
+        """Keep a socket.io connection open, passing each update to on_readings"""
+        delay = self.reconnect_delay
+        while True:
+            try:
+                if await self._stream_once(on_readings):
+                    delay = self.reconnect_delay
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Nightscout stream error: {e}")
+            finally:
+                self.streaming = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _stream_once(self, on_readings):
+        """Run one socket.io session. Returns True if it got authorized"""
+        ws_url = self.url.replace("http", "ws", 1) + "/socket.io/?EIO=4&transport=websocket"
+        authorized = False
+        # The server pings every pingInterval and gives up pingTimeout later.
+        # Hearing nothing for that long means the connection is dead, even if
+        # the socket never reports it (a half-open connection)
+        receive_timeout = (self.PING_INTERVAL + self.PING_TIMEOUT) / 1000
+        async with self.get_session().ws_connect(ws_url, headers=self._auth_headers()) as ws:
+            self.stats["stream_connects"] += 1
+            while True:
+                try:
+                    message = await ws.receive(timeout=receive_timeout)
+                except asyncio.TimeoutError:
+                    self.streaming = False
+                    self.stats["stream_timeouts"] += 1
+                    print("Nightscout stream went silent, reconnecting")
+                    break
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                                        aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+                    continue
+                data = message.data
+                if data == "2":
+                    # Engine.IO ping
+                    await ws.send_str("3")
+                elif data.startswith("0"):
+                    # Engine.IO open: use its ping timing, then join the default namespace
+                    try:
+                        handshake = json.loads(data[1:])
+                        receive_timeout = (
+                            handshake.get("pingInterval", self.PING_INTERVAL)
+                            + handshake.get("pingTimeout", self.PING_TIMEOUT)
+                        ) / 1000
+                    except (ValueError, TypeError, AttributeError):
+                        pass
+                    await ws.send_str("40")
+                elif data.startswith("40"):
+                    await ws.send_str("42" + json.dumps(["authorize", {
+                        "client": "web",
+                        "secret": self._hashed_secret(),
+                        "token": self.token or None,
+                        "history": 1,
+                    }]))
+                elif data.startswith("41") or data.startswith("1"):
+                    # Namespace or engine disconnect
+                    break
+                elif data.startswith("42"):
+                    event = json.loads(data[2:])
+                    if not event:
+                        continue
+                    if event[0] == "connected":
+                        authorized = True
+                    elif event[0] == "dataUpdate" and len(event) > 1:
+                        authorized = True
+                        self.streaming = True
+                        self.stats["stream_updates"] += 1
+                        update = event[1] or {}
+                        readings = [reading for reading in map(self._parse_entry, update.get("sgvs", [])) if reading]
+                        if readings:
+                            await on_readings(readings)
+        return authorized
+
+class BulbShadow:
+    """Client-side copy of the bulb's last confirmed state"""
+    FIELDS = ("is_on", "hue", "saturation", "brightness", "effect")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forget everything, so the next command is always sent"""
+        self.is_on = None
+        self.hue = None
+        self.saturation = None
+        self.brightness = None
+        # Id of the light effect running on the device, if any
+        self.effect = None
+        self.synced_at = None
+
+    def update_from_device(self, device, now):
+        """Copy the state reported by a freshly updated device"""
+        try:
+            self.is_on = device.is_on
+            self.brightness = device.brightness
+            hs = device.hs
+            # In white (color temperature) mode the reported hue isn't shown
+            if hs is not None and not device.color_temp:
+                self.hue, self.saturation = hs.hue, hs.saturation
+            else:
+                self.hue = self.saturation = None
+            effect = device.effect
+            self.effect = effect.id if effect is not None and effect.enable else None
+            self.synced_at = now
+        except Exception as e:
+            print(f"Error reading bulb state: {e}")
+            self.clear()
+
+    def matches(self, **target):
+        """Check if the bulb already has all the given values"""
+        return all(
+            getattr(self, field) == value
+            for field, value in target.items()
+            if value is not None
+        )
+
+    def apply(self, **target):
+        """Record values confirmed by the device"""
+        for field, value in target.items():
+            if value is not None:
+                setattr(self, field, value)
+
+class TapoConnection:
+    """Long-lived connection to a Tapo bulb
+
+    The handshake is done once and the device session is kept open. It is
+    only redone when the session gets too old, the credentials change or a
+    command fails. Concurrent callers share a single in-flight handshake and
+    commands to the device run one at a time.
+    """
+    def __init__(self, session_lifetime=3600, reconcile_interval=900):
+        self.session_lifetime = session_lifetime
+        # How often the shadow state is checked against the real bulb
+        self.reconcile_interval = reconcile_interval
+        self.shadow = BulbShadow()
+        self.device = None
+        self.credentials = None
+        self.connected_at = None
+        self._connect_task = None
+        self._command_lock = asyncio.Lock()
+        self.stats = {
+            "handshakes": 0,
+            "handshake_joins": 0,
+            "handshake_failures": 0,
+            "last_handshake_latency": None,
+            "total_handshake_time": 0.0,
+            "commands": 0,
+            "command_failures": 0,
+            "commands_suppressed": 0,
+            "reconciles": 0,
+        }
+
+    def configure(self, email, password, ip):
+        """Set the credentials, dropping the session if they changed"""
+        credentials = (email, password, ip)
+        if credentials != self.credentials:
+            self.credentials = credentials
+            self._drop_device()
+            self.shadow.clear()
+
+    @property
+    def is_connected(self):
+        """Check if there is a usable session to the device"""
+        if self.device is None or self.connected_at is None:
+            return False
+        loop = asyncio.get_running_loop()
+        return loop.time() - self.connected_at < self.session_lifetime
+
+    def _drop_device(self):
+        """Forget the current session, closing it in the background"""
+        device, self.device = self.device, None
+        self.connected_at = None
+        if device is not None:
+            try:
+                asyncio.get_running_loop().create_task(device.client.close())
+            except Exception as e:
+                print(f"Error closing Tapo session: {e}")
+
+    async def _handshake(self):
+        """Run the full connect handshake and fetch the device state"""
+        from plugp100.common.credentials import AuthCredential
+        from plugp100.new.device_factory import connect, DeviceConnectConfiguration
+
+        credentials = self.credentials
+        email, password, ip = credentials
+        device_configuration = DeviceConnectConfiguration(
+            host=ip,
+            credentials=AuthCredential(email, password)
+        )
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.stats["handshakes"] += 1
+        try:
+            device = await connect(device_configuration)
+            await device.update()
+        except Exception:
+            self.stats["handshake_failures"] += 1
+            raise
+        finally:
+            latency = loop.time() - started
+            self.stats["last_handshake_latency"] = latency
+            self.stats["total_handshake_time"] += latency
+
+        if credentials != self.credentials:
+            # Settings changed while we were connecting, this session is stale
+            await device.client.close()
+            raise ValueError("Tapo credentials changed during connect")
+
+        self._drop_device()
+        self.device = device
+        self.connected_at = loop.time()
+        # The handshake already fetched the state, use it as a free reconcile
+        self.shadow.update_from_device(device, self.connected_at)
+        return device
+
+    async def ensure_connected(self):
+        """Get a connected device, handshaking only when needed"""
+        if not self.credentials or not all(self.credentials):
+            raise ValueError("Tapo credentials not configured")
+        if self.is_connected:
+            return self.device
+        if self._connect_task is None or self._connect_task.done():
+            self._connect_task = asyncio.create_task(self._handshake())
+        else:
+            self.stats["handshake_joins"] += 1
+        # Shielded so one cancelled caller doesn't abort everyone's handshake
+        return await asyncio.shield(self._connect_task)
+
+    async def run(self, command):
+        """Run command(device) and retry once on a fresh session if it fails"""
+        async with self._command_lock:
+            return await self._run_locked(command)
+
+    async def _run_locked(self, command):
+        """Run a command while already holding the command lock"""
+        for attempt in range(2):
+            device = await self.ensure_connected()
+            self.stats["commands"] += 1
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(f"{base_url}/sgv.json", timeout=10) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if data and len(data) > 0:
-                                latest = data[0]
-                                return {
-                                    'value': latest['sgv'],
-                                    'direction': latest.get('direction', 'Unknown'),
-                                    'timestamp': latest['date'],
-                                    'date_string': latest['dateString'],
-                                    'raw_data': latest
-                                }
+                result = await command(device)
+                # plugp100 reports most command errors as a Failure result
+                if hasattr(result, "is_failure") and result.is_failure():
+                    raise result.error()
+                return result
             except Exception:
+                self.stats["command_failures"] += 1
+                self._drop_device()
+                # We no longer know what the bulb is showing
+                self.shadow.clear()
+                if attempt:
+                    raise
+
+    async def _reconcile_if_due(self):
+        """Refresh the shadow from the device when it's too old"""
+        loop = asyncio.get_running_loop()
+        synced_at = self.shadow.synced_at
+        if synced_at is not None and loop.time() - synced_at < self.reconcile_interval:
+            return
+        device = await self.ensure_connected()
+        if self.shadow.synced_at is not None and self.shadow.synced_at != synced_at:
+            # A new handshake just synced the shadow
+            return
+        self.stats["reconciles"] += 1
+        try:
+            await device.update()
+            self.shadow.update_from_device(device, loop.time())
+        except Exception as e:
+            print(f"Error reconciling bulb state: {e}")
+            self._drop_device()
+            self.shadow.clear()
+
+    async def set_power(self, is_on):
+        """Turn the bulb on or off unless it already is. Returns True if a command was sent"""
+        async with self._command_lock:
+            await self._reconcile_if_due()
+            if self.shadow.matches(is_on=is_on):
+                self.stats["commands_suppressed"] += 1
+                return False
+            if is_on:
+                await self._run_locked(lambda device: device.turn_on())
+            else:
+                await self._run_locked(lambda device: device.turn_off())
+            self.shadow.apply(is_on=is_on)
+            return True
+
+    async def set_color(self, hue, saturation, brightness=None):
+        """Set the bulb color unless it's already showing it. Returns True if a command was sent"""
+        async with self._command_lock:
+            await self._reconcile_if_due()
+            sent = False
+            # A running light effect hides the color, so it must be sent again
+            if self.shadow.effect is None and self.shadow.matches(hue=hue, saturation=saturation):
+                self.stats["commands_suppressed"] += 1
+            else:
+                await self._run_locked(lambda device: device.set_hue_saturation(hue, saturation))
+                self.shadow.apply(hue=hue, saturation=saturation)
+                # Setting a color ends the light effect
+                self.shadow.effect = None
+                sent = True
+            if brightness is not None:
+                if self.shadow.matches(brightness=brightness):
+                    self.stats["commands_suppressed"] += 1
+                else:
+                    await self._run_locked(lambda device: device.set_brightness(brightness))
+                    self.shadow.apply(brightness=brightness)
+                    sent = True
+            return sent
+
+    async def set_effect(self, effect):
+        """Start a plugp100 LightEffect on the device unless it's already running
+
+        Returns True if a command was sent, False if the effect was already
+        running and None if the bulb has no light effects.
+        """
+        async with self._command_lock:
+            await self._reconcile_if_due()
+            if self.shadow.matches(effect=effect.id):
+                self.stats["commands_suppressed"] += 1
+                return False
+            device = await self.ensure_connected()
+            if not device.has_effect:
+                return None
+            await self._run_locked(lambda device: device.set_light_effect(effect))
+            # The effect drives the color and brightness from now on
+            self.shadow.hue = self.shadow.saturation = self.shadow.brightness = None
+            self.shadow.apply(is_on=True, effect=effect.id)
+            return True
+
+    async def close(self):
+        """Close the device session"""
+        if self._connect_task is not None and not self._connect_task.done():
+            self._connect_task.cancel()
+        self._connect_task = None
+        device, self.device = self.device, None
+        self.connected_at = None
+        if device is not None:
+            await device.client.close()
+
+    def get_stats(self):
+        """Get handshake and command statistics"""
+        stats = dict(self.stats)
+        handshakes = stats["handshakes"]
+        stats["average_handshake_latency"] = stats["total_handshake_time"] / handshakes if handshakes else None
+        stats["shadow"] = {field: getattr(self.shadow, field) for field in BulbShadow.FIELDS}
+        return stats
+
+class BulbEffects:
+    """Alert effects (flashing, pulsing) in a band color
+
+    Bulbs with light effects (Tapo light strips) run the effect on the device
+    as a repeating sequence, which keeps going with no traffic from the app
+    and while the app is suspended. Other bulbs (like the L530E) show the
+    steady color, unless client_fallback is on: then a client loop steps
+    through the same frames, one command at a time, at least frame_interval
+    seconds apart and at most frame_budget frames per frame_period seconds.
+    Frames have their own allowance so they never hold back queued commands,
+    which halt the frames when they're sent. While the allowance is used up the bulb
+    shows the steady color at full brightness, never a dimmed frame. Failed
+    frames back off exponentially up to max_backoff seconds.
+    """
+    # Brightness steps (percent of the band brightness) and milliseconds per step
+    EFFECTS = {
+        "flash": ((100, 0), 500),
+        "pulse": ((100, 30), 1500),
+    }
+
+    def __init__(self, tapo, frame_interval=1.0, frame_budget=20, frame_period=60,
+                 client_fallback=False, max_backoff=60, effects=None):
+        self.tapo = tapo
+        # Brightness steps and step times by effect name, EFFECTS unless given
+        self.effects = effects or self.EFFECTS
+        self.frame_interval = frame_interval
+        self.frame_budget = frame_budget
+        self.frame_period = frame_period
+        self.frame_times = collections.deque()
+        self.client_fallback = client_fallback
+        self.max_backoff = max_backoff
+        self.active = None
+        self._frames_task = None
+        # Brightness the bulb had before the frames changed it, if known
+        self._restore_brightness = None
+        self.stats = {
+            "device_effects": 0,
+            "client_effects": 0,
+            "steady_fallbacks": 0,
+            "frames": 0,
+            "frame_failures": 0,
+            "steady_pauses": 0,
+        }
+
+    def build_light_effect(self, effect_id, name, frames, step_time):
+        """Describe the frames as a repeating device-side sequence effect"""
+        from plugp100.api.light_effect import LightEffect
+
+        hue, saturation, brightness = frames[0]
+        return LightEffect(
+            id=effect_id,
+            name=f"Diabuddy {name}",
+            brightness=brightness,
+            display_colors=[[hue, saturation, brightness]],
+            enable=1,
+            custom=1,
+            direction=1,
+            duration=0,
+            expansion_strategy=1,
+            repeat_times=0,
+            segments=[0],
+            sequence=[list(frame) for frame in frames],
+            spread=1,
+            transition=step_time,
+            type="sequence",
+        )
+
+    @staticmethod
+    def get_effect_id(name, hue, saturation, brightness=None):
+        """Get the id of an effect in the given color"""
+        return f"TapoStrip_Diabuddy_{name}_{hue}_{saturation}_{brightness or 100}"
+
+    def is_showing(self, effect_id):
+        """Check if client-driven frames are running for this effect"""
+        return self.is_running and self.active == effect_id
+
+    async def start(self, name, hue, saturation, brightness=None):
+        """Start an effect in the given color. Returns True if anything was sent"""
+        steps, step_time = self.effects[name]
+        band_brightness = brightness
+        brightness = brightness or 100
+        effect_id = self.get_effect_id(name, hue, saturation, brightness)
+        if self.is_showing(effect_id):
+            return False
+        restore = await self.stop()
+
+        frames = [(hue, saturation, brightness * step // 100) for step in steps]
+        sent = await self.tapo.set_effect(self.build_light_effect(effect_id, name, frames, step_time))
+        if sent is None and not self.client_fallback:
+            # No light effects on this bulb, show the band color steadily
+            self.stats["steady_fallbacks"] += 1
+            sent = await self.tapo.set_color(hue, saturation, band_brightness or restore)
+        elif sent is None:
+            # No light effects on this bulb, step through the frames from here.
+            # Bulbs don't take brightness 0, so the dark frames use the minimum.
+            frames = [(hue, saturation, max(1, frame[2])) for frame in frames]
+            if restore is None:
+                restore = self.tapo.shadow.brightness
+            self._frames_task = asyncio.create_task(self._run_frames(frames, step_time / 1000))
+            self._restore_brightness = restore
+            self.stats["client_effects"] += 1
+            sent = True
+        elif sent:
+            self.stats["device_effects"] += 1
+        self.active = effect_id
+        return sent
+
+    async def _run_frames(self, frames, step_time):
+        """Show the frames in a loop, waiting for each command to finish"""
+        loop = asyncio.get_running_loop()
+        interval = max(self.frame_interval, step_time)
+        failures = 0
+        steady = max(frames, key=lambda frame: frame[2])
+        while True:
+            for hue, saturation, brightness in frames:
+                started = loop.time()
+                try:
+                    if await self.tapo.set_color(hue, saturation, brightness):
+                        self.frame_times.append(loop.time())
+                    self.stats["frames"] += 1
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    self.stats["frame_failures"] += 1
+                    print(f"Error running bulb effect: {e}")
+
+                delay = interval - (loop.time() - started)
+                if failures:
+                    # The bulb is unreachable, don't hammer it with handshakes
+                    delay = min(self.max_backoff, self.frame_interval * 2 ** failures)
+                frame_wait = self.get_frame_wait(loop.time())
+                if frame_wait > delay and not failures and brightness < steady[2]:
+                    # Out of frames on a dim one, don't leave the bulb nearly
+                    # off until the allowance comes back
+                    try:
+                        await self.tapo.set_color(*steady)
+                        self.stats["steady_pauses"] += 1
+                    except Exception as e:
+                        self.stats["frame_failures"] += 1
+                        print(f"Error running bulb effect: {e}")
+                delay = max(delay, frame_wait)
+                await asyncio.sleep(max(0.0, delay))
+
+    def get_frame_wait(self, now):
+        """Get how long until the frame allowance allows another frame"""
+        while self.frame_times and now - self.frame_times[0] >= self.frame_period:
+            self.frame_times.popleft()
+        if len(self.frame_times) >= self.frame_budget:
+            return max(0.0, self.frame_times[0] + self.frame_period - now)
+        return 0.0
+
+    @property
+    def is_running(self):
+        """Check if client-driven frames are running"""
+        return self._frames_task is not None and not self._frames_task.done()
+
+    async def halt(self):
+        """Stop sending frames, keeping the brightness to restore for the next color"""
+        self.active = None
+        task, self._frames_task = self._frames_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def stop(self):
+        """Stop a client-driven effect. A device effect ends with the next color
+
+        Returns the brightness the bulb should go back to, if the effect changed it.
+        """
+        await self.halt()
+        restore, self._restore_brightness = self._restore_brightness, None
+        return restore
+
+    def get_stats(self):
+        """Get effect statistics"""
+        return dict(self.stats)
+
+class BulbCommand:
+    """A queued bulb command"""
+    __slots__ = ("priority", "sequence", "attribute", "action", "submitted_at", "deadline", "future", "effect_id")
+
+    def __init__(self, priority, sequence, attribute, action, submitted_at, deadline, future, effect_id=None):
+        self.priority = priority
+        self.sequence = sequence
+        # Commands for the same attribute ("color", "power") supersede each other
+        self.attribute = attribute
+        # action(tapo) returns the coroutine that sends the command
+        self.action = action
+        self.submitted_at = submitted_at
+        self.deadline = deadline
+        self.future = future
+        # Id of the effect the command starts, if it starts one
+        self.effect_id = effect_id
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+class BulbCommandQueue:
+    """Priority queue of commands for one bulb
+
+    Commands run one at a time from a single worker, most urgent first and
+    then oldest first. A newer command for an attribute replaces a queued one
+    of the same or lower priority, so only the latest color is ever sent.
+    Commands that miss their deadline are dropped. Except for critical
+    commands, sends are limited to budget commands per period seconds and
+    min_interval seconds apart, so bursts of updates never flood the bulb.
+    Each send gets at most send_timeout seconds, however long its deadline,
+    so a hung bulb holds a critical command back by seconds, not minutes.
+
+    Each submit returns a future that resolves to True if the command was
+    sent, False if the bulb already had that state, or None if the command
+    was superseded, cancelled or expired.
+    """
+    CRITICAL = 0
+    ALERT = 1
+    MANUAL = 2
+    ROUTINE = 3
+    DEMO = 4
+
+    def __init__(self, tapo, budget=10, period=60, min_interval=1.0, send_timeout=10, effects=None):
+        self.tapo = tapo
+        self.effects = effects or BulbEffects(tapo)
+        self.budget = budget
+        self.period = period
+        self.min_interval = min_interval
+        self.send_timeout = send_timeout
+        self.queue = []
+        # Latest queued command per attribute
+        self.queued = {}
+        self.sent_times = collections.deque()
+        self._sequence = 0
+        self._wakeup = None
+        self._worker = None
+        self.stats = {
+            "submitted": 0,
+            "superseded": 0,
+            "cancelled": 0,
+            "expired": 0,
+            "sent": 0,
+            "suppressed": 0,
+            "failures": 0,
+            "throttled_time": 0.0,
+            "effects_halted": 0,
+            "max_critical_latency": 0.0,
+        }
+
+    def submit(self, attribute, action, priority=ROUTINE, timeout=60, effect_id=None):
+        """Queue action(tapo) and get a future for its result"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.stats["submitted"] += 1
+        older = self.queued.get(attribute)
+        if older is not None and older.priority >= priority:
+            self.stats["superseded"] += 1
+            self._drop(older)
+
+        future = loop.create_future()
+        # Fire-and-forget callers never look at the result
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._sequence += 1
+        command = BulbCommand(priority, self._sequence, attribute, action, now, now + timeout, future, effect_id)
+        heapq.heappush(self.queue, command)
+        self.queued[attribute] = command
+
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return future
+
+    def set_color(self, hue, saturation, brightness=None, priority=ROUTINE, timeout=60):
+        """Queue a color change"""
+        async def show_color(tapo):
+            restore = await self.effects.stop()
+            return await tapo.set_color(hue, saturation, brightness or restore)
+        return self.submit("color", show_color, priority, timeout)
+
+    def set_effect(self, name, hue, saturation, brightness=None, priority=ROUTINE, timeout=60):
+        """Queue an effect in place of a steady color"""
+        return self.submit(
+            "color",
+            lambda tapo: self.effects.start(name, hue, saturation, brightness),
+            priority,
+            timeout,
+            BulbEffects.get_effect_id(name, hue, saturation, brightness),
+        )
+
+    def set_power(self, is_on, priority=MANUAL, timeout=30):
+        """Queue turning the bulb on or off"""
+        async def switch_power(tapo):
+            # Also undoes the dimming of frames halted for this command
+            await self._end_effects(tapo)
+            return await tapo.set_power(is_on)
+        return self.submit("power", switch_power, priority, timeout)
+
+    def stop_effects(self, priority=MANUAL, timeout=30):
+        """Queue stopping a client-driven effect, in place of any queued color"""
+        return self.submit("color", self._end_effects, priority, timeout)
+
+    async def _end_effects(self, tapo):
+        """Stop a client-driven effect and undo the dimming it left behind"""
+        restore = await self.effects.stop()
+        if restore:
+            try:
+                await tapo.run(lambda device: device.set_brightness(restore))
+            except Exception as e:
+                # Stopping monitoring doesn't wait on this, so don't leave it unretrieved
+                print(f"Error restoring bulb brightness: {e}")
+                return False
+            tapo.shadow.apply(brightness=restore)
+            return True
+        return False
+
+    def cancel(self, attribute=None):
+        """Drop queued commands (for one attribute, or all). Returns how many were dropped"""
+        dropped = 0
+        for command in self.queue:
+            if not command.future.done() and attribute in (None, command.attribute):
+                self._drop(command)
+                dropped += 1
+        self.stats["cancelled"] += dropped
+        return dropped
+
+    def _drop(self, command):
+        """Resolve a command that won't be sent. It's skipped when it reaches the front"""
+        if self.queued.get(command.attribute) is command:
+            del self.queued[command.attribute]
+        if not command.future.done():
+            command.future.set_result(None)
+
+    def _pop_command(self, now):
+        """Get the most urgent live command, dropping expired ones"""
+        while self.queue:
+            command = heapq.heappop(self.queue)
+            if command.future.done():
+                continue
+            if now > command.deadline:
+                self.stats["expired"] += 1
+                self._drop(command)
                 continue
+            if self.queued.get(command.attribute) is command:
+                del self.queued[command.attribute]
+            return command
         return None
 
+    def get_wait(self, now):
+        """Get how long until the budget allows another command"""
+        while self.sent_times and now - self.sent_times[0] >= self.period:
+            self.sent_times.popleft()
+        wait = 0.0
+        if self.sent_times:
+            wait = self.min_interval - (now - self.sent_times[-1])
+        if len(self.sent_times) >= self.budget:
+            wait = max(wait, self.sent_times[0] + self.period - now)
+        return max(0.0, wait)
+
+    async def _run(self):
+        """Send queued commands in priority order whenever the budget allows"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            command = self._pop_command(loop.time())
+            if command is None:
+                await self._wakeup.wait()
+                continue
+
+            if command.priority != self.CRITICAL:
+                wait = self.get_wait(loop.time())
+                if wait > 0:
+                    # Put it back, something newer or more urgent may arrive meanwhile
+                    heapq.heappush(self.queue, command)
+                    if command.attribute not in self.queued:
+                        self.queued[command.attribute] = command
+                    waited_from = loop.time()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    # Only the time spent, a wakeup can cut the wait short
+                    self.stats["throttled_time"] += loop.time() - waited_from
+                    continue
+
+            if self.effects.is_running and not self.effects.is_showing(command.effect_id):
+                # The command changes what the bulb shows, so the frames must
+                # not keep going once it's sent. The same effect keeps running.
+                await self.effects.halt()
+                self.stats["effects_halted"] += 1
+
+            try:
+                # Bound the whole send, including a reconnect, so a hung one
+                # can't hold up more urgent commands until its own deadline
+                timeout = max(0.1, min(self.send_timeout, command.deadline - loop.time()))
+                result = await asyncio.wait_for(command.action(self.tapo), timeout)
+            except Exception as e:
+                self.stats["failures"] += 1
+                if isinstance(e, asyncio.TimeoutError):
+                    # The command may or may not have reached the bulb
+                    self.tapo.shadow.clear()
+                print(f"Error sending bulb command: {e!r}")
+                if not command.future.done():
+                    command.future.set_exception(e)
+                continue
+
+            if result:
+                self.sent_times.append(loop.time())
+                self.stats["sent"] += 1
+            else:
+                self.stats["suppressed"] += 1
+            if command.priority == self.CRITICAL:
+                latency = loop.time() - command.submitted_at
+                self.stats["max_critical_latency"] = max(self.stats["max_critical_latency"], latency)
+            if not command.future.done():
+                command.future.set_result(result)
+
+    async def close(self):
+        """Stop the worker and any client-driven effect, dropping queued commands"""
+        self.cancel()
+        await self.effects.stop()
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+    def get_stats(self):
+        """Get command queue statistics"""
+        stats = dict(self.stats)
+        stats["queued"] = sum(1 for command in self.queue if not command.future.done())
+        return stats
+
+class PollingPolicy:
+    """Adjusts the cadence-based poll delay. The default leaves it unchanged
+
+    Subclass and override adjust_delay() to plug in a different policy.
+    """
+    def adjust_delay(self, delay, scheduler, now):
+        """Get the delay to actually use given the cadence-based delay"""
+        return delay
+
+class RiskPollingPolicy(PollingPolicy):
+    """Watches the next reading closely when a crossing is near, backs off when stable
+
+    Readings only arrive on the sensor's cadence, so polling between them
+    finds nothing new. Instead of shortening the whole delay, a near
+    crossing wakes right when the next reading is due and retries more often
+    until it shows up. Being out of range but flat changes nothing.
+    """
+    # Approximate rate of change in mg/dL per minute for each xDrip+ trend
+    DIRECTION_RATES = {
+        "DoubleUp": 3.5,
+        "SingleUp": 2.5,
+        "FortyFiveUp": 1.5,
+        "Flat": 0.0,
+        "FortyFiveDown": -1.5,
+        "SingleDown": -2.5,
+        "DoubleDown": -3.5,
+    }
+
+    def __init__(self, get_bands, urgent_retry=5, watch_retry=10,
+                 urgent_horizon=15, watch_horizon=30, stable_margin=30, stable_rate=0.5):
+        # get_bands() returns the current BandTable
+        self.get_bands = get_bands
+        self.urgent_retry = urgent_retry
+        self.watch_retry = watch_retry
+        self.urgent_horizon = urgent_horizon
+        self.watch_horizon = watch_horizon
+        self.stable_margin = stable_margin
+        self.stable_rate = stable_rate
+
+    def get_rate(self, scheduler):
+        """Estimate the rate of change in mg/dL per minute"""
+        readings = scheduler.recent_readings
+        if len(readings) >= 2:
+            (first_time, first_value, _), (last_time, last_value, _) = readings[0], readings[-1]
+            minutes = (last_time - first_time) / 60
+            # Only trust the slope over a span the sensor would report on
+            if 0 < minutes <= 20:
+                return (last_value - first_value) / minutes
+        if readings:
+            return self.DIRECTION_RATES.get(readings[-1][2], 0.0)
+        return 0.0
+
+    def minutes_to_crossing(self, value, rate, thresholds):
+        """Get the minutes until the next threshold in the direction of travel"""
+        if rate < 0:
+            below = [threshold for threshold in thresholds if threshold < value]
+            if below:
+                return (value - max(below)) / -rate
+        elif rate > 0:
+            above = [threshold for threshold in thresholds if threshold >= value]
+            if above:
+                return (min(above) - value) / rate
+        return float("inf")
+
+    def tighten(self, delay, scheduler, now, retry_interval):
+        """Wake when the next reading is due and retry every retry_interval while it's late"""
+        expected = scheduler.next_expected_reading(now)
+        if expected is None:
+            return delay
+        if now < expected:
+            return min(delay, expected - now)
+        return max(1, min(delay, retry_interval))
+
+    def adjust_delay(self, delay, scheduler, now):
+        if not scheduler.recent_readings:
+            return delay
+        value = scheduler.recent_readings[-1][1]
+        bands = self.get_bands()
+        low, high = bands.normal_range
+        rate = self.get_rate(scheduler)
+        minutes = self.minutes_to_crossing(value, rate, bands.thresholds)
+
+        # About to cross a threshold: catch the next reading as soon as it lands
+        if minutes <= self.urgent_horizon:
+            return self.tighten(delay, scheduler, now, self.urgent_retry)
+        if minutes <= self.watch_horizon:
+            return self.tighten(delay, scheduler, now, self.watch_retry)
+        if low is None:
+            return delay
+
+        # Comfortably in range and flat: skip a reading
+        distance = min(value - low, high - value)
+        if distance >= self.stable_margin and abs(rate) <= self.stable_rate:
+            return delay + scheduler.reading_interval
+        return delay
+
+class ReadingScheduler:
+    """Decides when to poll next, following the CGM reading cadence
+
+    Sensors produce a reading every few minutes. Instead of polling on a
+    fixed interval, wake just after the next reading is expected, retry
+    quickly for a short while if it's late, then wait for the one after.
+    """
+    def __init__(self, fallback_interval=100, reading_interval=300, wake_delay=10,
+                 retry_interval=15, retry_window=90, clock=time.time, policy=None):
+        self.fallback_interval = fallback_interval
+        self.reading_interval = reading_interval
+        self.wake_delay = wake_delay
+        self.retry_interval = retry_interval
+        self.retry_window = retry_window
+        self.clock = clock
+        self.policy = policy or PollingPolicy()
+        self.last_reading_time = None
+        # (time, value, direction) of the last few readings, for the policy
+        self.recent_readings = collections.deque(maxlen=4)
+
+    def reset(self):
+        """Forget the learned reading phase"""
+        self.last_reading_time = None
+        self.recent_readings.clear()
+
+    def record_reading(self, timestamp_ms, value=None, direction=None):
+        """Learn the phase (and interval) from a reading's timestamp"""
+        reading_time = timestamp_ms / 1000
+        if self.last_reading_time is not None:
+            gap = reading_time - self.last_reading_time
+            if gap <= 0:
+                return
+            # Consecutive readings refine the interval (1 and 5 minute sensors)
+            if 50 <= gap <= 330:
+                self.reading_interval = 0.5 * self.reading_interval + 0.5 * gap
+        self.last_reading_time = reading_time
+        if value is not None:
+            self.recent_readings.append((reading_time, value, direction))
+
+    def next_expected_reading(self, now=None):
+        """Get the time of the next reading we haven't given up waiting for"""
+        if self.last_reading_time is None:
+            return None
+        now = self.clock() if now is None else now
+        expected = self.last_reading_time + self.reading_interval
+        if now > expected + self.wake_delay + self.retry_window:
+            # Skip readings that never arrived
+            missed = (now - expected - self.wake_delay - self.retry_window) // self.reading_interval + 1
+            expected += missed * self.reading_interval
+        return expected
+
+    def next_delay(self):
+        """Get the number of seconds to sleep before the next poll"""
+        now = self.clock()
+        expected = self.next_expected_reading(now)
+        if expected is None:
+            delay = self.fallback_interval
+        else:
+            wake_at = expected + self.wake_delay
+            if now < wake_at:
+                delay = wake_at - now
+            else:
+                # The reading is late: retry quickly until the window closes
+                delay = max(1, min(self.retry_interval, wake_at + self.retry_window - now))
+        return self.policy.adjust_delay(delay, self, now)
+
+class StatusView:
+    """View-model for the status widgets
+
+    Changes are recorded with set() and applied in a single render pass on the
+    next event loop tick, so several updates in one tick cost one pass. Only
+    values that differ from what a widget already shows are written, since
+    every write crosses into the native UI.
+    """
+    def __init__(self):
+        # name -> (target, attribute), where target is a widget or its style
+        self.bindings = {}
+        self.shown = {}
+        self.pending = {}
+        self._scheduled = False
+        self.stats = {
+            "updates": 0,
+            "coalesced": 0,
+            "renders": 0,
+            "writes": 0,
+            "unchanged": 0,
+        }
+
+    def bind(self, name, target, attribute):
+        """Connect a property name to a widget attribute"""
+        self.bindings[name] = (target, attribute)
+        self.shown[name] = getattr(target, attribute)
+        self.pending.pop(name, None)
+
+    def get(self, name):
+        """Get the value a property has or is about to have"""
+        if name in self.pending:
+            return self.pending[name]
+        return self.shown.get(name)
+
+    def set(self, name, value):
+        """Change a property, to be applied at the next render"""
+        self.stats["updates"] += 1
+        if name in self.pending:
+            self.stats["coalesced"] += 1
+        self.pending[name] = value
+        if not self._scheduled:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.render()
+                return
+            self._scheduled = True
+            loop.call_soon(self.render)
+
+    def render(self):
+        """Write the changed properties to the widgets"""
+        self._scheduled = False
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        self.stats["renders"] += 1
+        for name, value in pending.items():
+            if name not in self.bindings:
+                continue
+            if self.shown.get(name) == value:
+                self.stats["unchanged"] += 1
+                continue
+            target, attribute = self.bindings[name]
+            try:
+                setattr(target, attribute, value)
+                self.shown[name] = value
+                self.stats["writes"] += 1
+            except Exception as e:
+                print(f"Error updating {name}: {e}")
+
+    def get_stats(self):
+        """Get render statistics"""
+        return dict(self.stats)
+
+class StatusIconRenderer:
+    """Draws the glucose value and trend arrow over a band's status icon
+
+    Drawing needs Pillow; without it the app keeps showing the plain band
+    icons. Drawing runs in a worker thread, off the event loop. Rendered
+    icons are kept in a bounded LRU keyed by (band, value, arrow), so a
+    repeated reading costs nothing.
+    """
+    # Trend arrow text -> (angle in degrees, number of arrowheads)
+    ARROWS = {
+        "↑↑": (90, 2),
+        "↑": (90, 1),
+        "↗": (45, 1),
+        "→": (0, 1),
+        "↘": (-45, 1),
+        "↓": (-90, 1),
+        "↓↓": (-90, 2),
+    }
+
+    def __init__(self, icon_dir, capacity=64):
+        self.icon_dir = icon_dir
+        self.capacity = capacity
+        self.cache = collections.OrderedDict()
+        # Decoded band icons by filename and fonts by size, shared by all renders
+        self.bases = {}
+        self.fonts = {}
+        try:
+            from PIL import Image, ImageDraw, ImageFont
+            self.pil = (Image, ImageDraw, ImageFont)
+        except ImportError:
+            self.pil = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "renders": 0,
+            "render_failures": 0,
+            "total_render_time": 0.0,
+            "max_render_time": 0.0,
+        }
+
+    @property
+    def available(self):
+        """Check if Pillow is there to draw icons"""
+        return self.pil is not None
+
+    def get(self, key):
+        """Get a rendered icon from the cache"""
+        image = self.cache.get(key)
+        if image is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.cache.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        """Add a rendered icon, dropping the least recently used ones"""
+        self.cache[key] = image
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        """Forget rendered icons, after the bands changed"""
+        self.cache.clear()
+        self.bases.clear()
+
+    async def render(self, key, icon):
+        """Draw the icon for key = (band, value text, arrow) and cache it as a toga.Image"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            png = await loop.run_in_executor(None, self.draw, icon, key[1], key[2])
+            # Native images are created on the event loop thread
+            image = toga.Image(png)
+        except Exception as e:
+            self.stats["render_failures"] += 1
+            print(f"Error rendering status icon: {e}")
+            return None
+        elapsed = time.perf_counter() - started
+        self.stats["renders"] += 1
+        self.stats["total_render_time"] += elapsed
+        self.stats["max_render_time"] = max(self.stats["max_render_time"], elapsed)
+        self.put(key, image)
+        return image
+
+    def draw(self, icon, value_text, arrow):
+        """Draw the value and arrow over a band icon and get the PNG bytes"""
+        Image, ImageDraw, ImageFont = self.pil
+        base = self.bases.get(icon)
+        if base is None:
+            with Image.open(os.path.join(self.icon_dir, icon)) as source:
+                base = source.convert("RGBA")
+            self.bases[icon] = base
+
+        image = base.copy()
+        size = image.width
+        draw = ImageDraw.Draw(image)
+
+        # Dark banner over the bottom of the icon for contrast
+        top = int(size * 0.6)
+        draw.rounded_rectangle(
+            (int(size * 0.04), top, int(size * 0.96), int(size * 0.96)),
+            radius=int(size * 0.08),
+            fill=(0, 0, 0, 170),
+        )
+        banner_middle = (top + int(size * 0.96)) / 2
+
+        font_size = int(size * 0.26)
+        font = self.fonts.get(font_size)
+        if font is None:
+            try:
+                font = ImageFont.load_default(size=font_size)
+            except TypeError:
+                # Pillow before 10.1 only has the small bitmap font
+                font = ImageFont.load_default()
+            self.fonts[font_size] = font
+        arrow_width = int(size * 0.22) if arrow in self.ARROWS else 0
+        left, upper, right, lower = draw.textbbox((0, 0), value_text, font=font)
+        x = (size - (right - left) - arrow_width) / 2 - left
+        y = banner_middle - (lower - upper) / 2 - upper
+        draw.text((x, y), value_text, font=font, fill=(255, 255, 255, 255))
+
+        if arrow_width:
+            angle, heads = self.ARROWS[arrow]
+            self.draw_arrow(
+                draw, x + right + arrow_width / 2 + size * 0.02, banner_middle,
+                arrow_width * 0.9, angle, heads,
+            )
+
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+    def draw_arrow(self, draw, center_x, center_y, length, angle, heads):
+        """Draw a trend arrow pointing at angle degrees (0 is right, 90 is up)"""
+        radians = math.radians(angle)
+        cos, sin = math.cos(radians), math.sin(radians)
+
+        def point(along, across):
+            # Screen y grows downwards
+            return (
+                center_x + along * cos - across * sin,
+                center_y - along * sin - across * cos,
+            )
+
+        half = length / 2
+        width = max(2, int(length * 0.14))
+        draw.line((point(-half, 0), point(half, 0)), fill=(255, 255, 255, 255), width=width)
+        head = length * 0.4
+        for index in range(heads):
+            tip = half - index * head * 0.7
+            draw.polygon(
+                (point(tip, 0), point(tip - head, head * 0.6), point(tip - head, -head * 0.6)),
+                fill=(255, 255, 255, 255),
+            )
+
+    def get_stats(self):
+        """Get cache and render time statistics"""
+        stats = dict(self.stats)
+        renders = stats["renders"]
+        stats["average_render_time"] = stats["total_render_time"] / renders if renders else None
+        stats["cached"] = len(self.cache)
+        return stats
+
+class AlertDispatcher:
+    """Queues alert dialogs and decides which glucose alerts are worth showing
+
+    Glucose alerts go out when the band gets more urgent, and otherwise at
+    most once per cooldown for the band, however many readings stay in it.
+    Going back in range resets that, so the next excursion alerts straight
+    away. Dialogs are shown one at a time by a background task, so nothing
+    waits for them to be dismissed. While one is open, newer alerts replace
+    queued ones of the same kind and only the latest glucose alert is kept.
+    """
+    def __init__(self, show, cooldowns=None, default_cooldown=900, clock=time.monotonic):
+        # show(title, message) is a coroutine that returns when the dialog is closed
+        self.show = show
+        # Seconds between repeat alerts, by band name
+        self.cooldowns = cooldowns or {}
+        self.default_cooldown = default_cooldown
+        self.clock = clock
+        self.active_band = None
+        self.active_urgency = 0
+        self.last_alerted = {}
+        self.pending = {}
+        self._sequence = 0
+        self._worker = None
+        self.stats = {
+            "notified": 0,
+            "escalations": 0,
+            "suppressed": 0,
+            "coalesced": 0,
+            "delivered": 0,
+        }
+
+    def reset(self):
+        """Forget the current excursion, e.g. when monitoring stops"""
+        self.active_band = None
+        self.active_urgency = 0
+        self.pending.pop("glucose", None)
+
+    def notify_glucose(self, band, urgency, title, message):
+        """Consider a glucose alert for a new reading in band"""
+        self.stats["notified"] += 1
+        if urgency <= 0:
+            self.reset()
+            return False
+
+        now = self.clock()
+        escalated = urgency > self.active_urgency
+        last = self.last_alerted.get(band)
+        due = last is None or now - last >= self.cooldowns.get(band, self.default_cooldown)
+        self.active_band = band
+        self.active_urgency = urgency
+        if not escalated and not due:
+            self.stats["suppressed"] += 1
+            return False
+
+        if escalated:
+            self.stats["escalations"] += 1
+        self.last_alerted[band] = now
+        self.enqueue("glucose", urgency, title, message)
+        return True
+
+    def enqueue(self, key, urgency, title, message):
+        """Queue a dialog, replacing a queued one with the same key"""
+        if key in self.pending:
+            self.stats["coalesced"] += 1
+        self._sequence += 1
+        self.pending[key] = (urgency, self._sequence, title, message)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """Show queued dialogs one at a time, most urgent first"""
+        while self.pending:
+            key = max(self.pending, key=lambda key: (self.pending[key][0], -self.pending[key][1]))
+            urgency, sequence, title, message = self.pending.pop(key)
+            try:
+                await self.show(title, message)
+                self.stats["delivered"] += 1
+            except Exception as e:
+                print(f"Error showing alert: {e}")
+
+    async def close(self):
+        """Drop queued dialogs and stop the worker"""
+        self.pending.clear()
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+    def get_stats(self):
+        """Get alert statistics"""
+        stats = dict(self.stats)
+        stats["queued"] = len(self.pending)
+        return stats
+
 class DiabuddyBulb(toga.App):
     def __init__(self):
         super().__init__()
-        self.xdrip_client = XDripClient()
-        self.tapo_device = None
+        # Nightscout URL; when empty, readings come from xDrip+ on this phone
+        self.nightscout_url = ""
+        self.nightscout_secret = ""
+        self.data_source = XDripClient()
+        self.stream_task = None
+        self.tapo = TapoConnection()
+        self.bulb_queue = BulbCommandQueue(self.tapo)
         self.is_monitoring = False
         self.monitoring_task = None
         self.bulb_is_on = False
+
+        # On-disk glucose history, opened in startup()
+        self.history_log = None
+
+        # Timestamp of the last reading that went through the pipeline
+        self.last_reading_timestamp = None
+        self.poll_stats = {"processed": 0, "skipped": 0}
+        # Seconds between statistics lines in the log while monitoring
+        self.stats_log_interval = 3600
+        self.stats_logged_at = None
         
         # Settings with defaults
         self.tapo_email = ""
         self.tapo_password = ""
         self.tapo_ip = ""
         self.check_interval = 100
+
+        # Optional local receiver for readings uploaded by xDrip+
+        self.push_enabled = False
+        self.push_port = 17581
+        self.push_secret = ""
+        self.push_receiver = None
+        # While pushes are arriving, polling only runs as a slow watchdog
+        self.push_watchdog_interval = 600
+
+        # Glucose alert dialogs: minutes before repeating an alert for a band
+        # that hasn't changed (bands not listed use alert_cooldown)
+        self.alert_cooldown = 15
+        self.alert_cooldowns = {"critical": 5, "low": 10, "high": 60}
+        self.alert_dispatcher = AlertDispatcher(self.show_dialog)
+        self.update_alert_cooldowns()
+        self.scheduler = ReadingScheduler(
+            fallback_interval=self.check_interval,
+            policy=RiskPollingPolicy(lambda: self.bands),
+        )
         
         # Glucose thresholds with defaults
         self.critical_low_threshold = 50
         self.low_threshold = 70
         self.high_threshold = 180
+
+        # Glucose bands, compiled into a lookup table whenever settings change.
+        # Custom bands (in glucose_units) replace the four threshold bands.
+        self.glucose_units = "mg/dL"
+        self.custom_bands = None
+        self.bands = BandTable.from_thresholds(
+            self.critical_low_threshold, self.low_threshold, self.high_threshold
+        )
+
+        # Switch to an alert this many minutes before the trend crosses its
+        # threshold (0 turns prediction off)
+        self.prediction_lead = 15
+        self.predictor = TrendPredictor()
+
+        # Hysteresis (mg/dL), minimum dwell (minutes) and smoothing for alert levels
+        self.hysteresis_margin = 3
+        self.min_dwell = 10
+        self.smoothing = 0.0
+        self.classifier = self.create_classifier()
+
+        # "bands" shows the band colors, "gradient" blends the hue continuously
+        # from the glucose value projected gradient_trend minutes ahead
+        self.color_mode = "bands"
+        self.gradient_trend = 10
+        # Flash from the app on bulbs without device effects (sends a command
+        # every second or so while it runs, within the bulb command budget)
+        self.client_effects = False
         
         # Settings state
         self.settings_visible = False
@@ -70,6 +2529,15 @@ class DiabuddyBulb(toga.App):
         
         # Current status for icon
         self.current_status = "ready"
+        # Decoded status icons by filename
+        self.icon_images = {}
+        # Status icons with the value and arrow drawn on, and the one wanted now
+        self.icon_renderer = StatusIconRenderer(os.path.dirname(os.path.abspath(__file__)))
+        self.status_icon_key = None
+        # Last (glucose_value, direction, alert_level) shown, to redraw it in a new language
+        self.last_status = None
+        # Status widgets are only written through the view-model
+        self.status_view = StatusView()
         
         # Color palette
         self.colors = {
@@ -117,6 +2585,13 @@ class DiabuddyBulb(toga.App):
                 "critical_low_label": "Critical Low:",
                 "low_label": "Low:",
                 "high_label": "High:",
+                "nightscout_label": "Nightscout:",
+                "push_label": "Receive readings pushed by xDrip+",
+                "push_secret_label": "Secret",
+                "push_secret_placeholder": "Created when enabled",
+                "gradient_label": "Smooth color gradient",
+                "client_effects_label": "Flash from the app on bulbs without effects",
+                "units_label": "Units:",
                 
                 # Status messages
                 "bulb_connected": "💡 Bulb: Connected",
@@ -131,7 +2606,7 @@ class DiabuddyBulb(toga.App):
                 "bulb_off": "Bulb: Off",
                 
                 # Alert levels
-                "alert_critical_low": "🔴 CRITICAL LOW",
+                "alert_critical": "🔴 CRITICAL LOW",
                 "alert_low": "🟣 LOW",
                 "alert_normal": "🟢 NORMAL", 
                 "alert_high": "🟡 HIGH",
@@ -143,6 +2618,8 @@ class DiabuddyBulb(toga.App):
                 "monitoring_stopped": "Monitoring stopped",
                 "connections_working": "✅ Connections working!",
                 "check_complete": "Check complete: {}",
+                "check_bulb_not_connected": "Glucose: {} (Bulb not connected)",
+                "check_configure_bulb": "Glucose: {} (Configure bulb in Settings)",
                 "language_changed": "Language changed to {}",
                 "start_monitoring_first": "Please start monitoring first",
                 "could_not_get_glucose": "❌ Could not get glucose reading",
@@ -153,10 +2630,8 @@ class DiabuddyBulb(toga.App):
                 
                 # Color meanings
                 "color_meanings_title": "🎨 COLOR MEANINGS:",
-                "critical_low_color": "🔴 RED: Critical Low (<{}) - Emergency!",
-                "low_color": "🟣 PINK: Low ({}-{}) - Needs attention",
-                "normal_color": "🟢 GREEN: Normal ({}-{}) - All good!",
-                "high_color": "🟡 YELLOW: High (> {}) - Needs attention",
+                "band_below": "below {}",
+                "band_above": "{} and above",
             },
             'es': {
                 "start_monitoring": "Iniciar Monitoreo",
@@ -181,6 +2656,13 @@ class DiabuddyBulb(toga.App):
                 "critical_low_label": "Baja Crítica:",
                 "low_label": "Baja:",
                 "high_label": "Alta:",
+                "nightscout_label": "Nightscout:",
+                "push_label": "Recibir lecturas enviadas por xDrip+",
+                "push_secret_label": "Secreto",
+                "push_secret_placeholder": "Se crea al activarlo",
+                "gradient_label": "Degradado de color continuo",
+                "client_effects_label": "Parpadear desde la app en bombillas sin efectos",
+                "units_label": "Unidades:",
                 "bulb_connected": "💡 Bombilla: Conectada",
                 "bulb_failed": "💡 Bombilla: Conexión Fallida",
                 "status_ready": "Listo",
@@ -191,7 +2673,7 @@ class DiabuddyBulb(toga.App):
                 "status_check_failed": "Comprobación Fallida",
                 "bulb_on": "Bombilla: Encendida",
                 "bulb_off": "Bombilla: Apagada",
-                "alert_critical_low": "🔴 BAJA CRÍTICA",
+                "alert_critical": "🔴 BAJA CRÍTICA",
                 "alert_low": "🟣 BAJA",
                 "alert_normal": "🟢 NORMAL", 
                 "alert_high": "🟡 ALTA",
@@ -201,6 +2683,8 @@ class DiabuddyBulb(toga.App):
                 "monitoring_stopped": "Monitoreo detenido",
                 "connections_working": "✅ ¡Conexiones funcionando!",
                 "check_complete": "Comprobación completa: {}",
+                "check_bulb_not_connected": "Glucosa: {} (Bombilla no conectada)",
+                "check_configure_bulb": "Glucosa: {} (Configura la bombilla en Ajustes)",
                 "language_changed": "Idioma cambiado a {}",
                 "start_monitoring_first": "Inicia el monitoreo",
                 "could_not_get_glucose": "❌ No se pudo obtener la lectura de glucosa",
@@ -209,10 +2693,8 @@ class DiabuddyBulb(toga.App):
                 "bulb_turned_off": "Bombilla apagada",
                 "bulb_control_failed": "Error al controlar la bombilla",
                 "color_meanings_title": "🎨 SIGNIFICADO DE COLORES:",
-                "critical_low_color": "🔴 ROJO: Baja Crítica (<{}) - ¡Emergencia!",
-                "low_color": "🟣 ROSA: Baja ({}-{}) - ¡Necesita atención!",
-                "normal_color": "🟢 VERDE: Normal ({}-{}) - ¡Todo bien!",
-                "high_color": "🟡 AMARILLO: Alta (> {}) - ¡Necesita atención!",
+                "band_below": "menos de {}",
+                "band_above": "{} o más",
             },
             'fr': {
                 "start_monitoring": "Démarrer Surveillance",
@@ -237,6 +2719,13 @@ class DiabuddyBulb(toga.App):
                 "critical_low_label": "Critiquement Bas:",
                 "low_label": "Bas:",
                 "high_label": "Élevé:",
+                "nightscout_label": "Nightscout:",
+                "push_label": "Recevoir les lectures envoyées par xDrip+",
+                "push_secret_label": "Secret",
+                "push_secret_placeholder": "Créé à l'activation",
+                "gradient_label": "Dégradé de couleur continu",
+                "client_effects_label": "Clignoter depuis l'app sur les ampoules sans effets",
+                "units_label": "Unités:",
                 "bulb_connected": "💡 Ampoule: Connectée",
                 "bulb_failed": "💡 Ampoule: Échec de Connexion",
                 "status_ready": "Prêt",
@@ -247,7 +2736,7 @@ class DiabuddyBulb(toga.App):
                 "status_check_failed": "Échec de la Vérification",
                 "bulb_on": "Ampoule: Allumée",
                 "bulb_off": "Ampoule: Éteinte",
-                "alert_critical_low": "🔴 CRITIQUEMENT BAS",
+                "alert_critical": "🔴 CRITIQUEMENT BAS",
                 "alert_low": "🟣 BAS",
                 "alert_normal": "🟢 NORMAL", 
                 "alert_high": "🟡 ÉLEVÉ",
@@ -257,6 +2746,8 @@ class DiabuddyBulb(toga.App):
                 "monitoring_stopped": "Surveillance arrêtée",
                 "connections_working": "✅ Connexions fonctionnelles !",
                 "check_complete": "Vérification terminée: {}",
+                "check_bulb_not_connected": "Glucose: {} (Ampoule non connectée)",
+                "check_configure_bulb": "Glucose: {} (Configurez l'ampoule dans les Paramètres)",
                 "language_changed": "Langue changée en {}",
                 "start_monitoring_first": "Veuillez d'abord démarrer la surveillance",
                 "could_not_get_glucose": "❌ Impossible d'obtenir la lecture de glucose",
@@ -265,10 +2756,8 @@ class DiabuddyBulb(toga.App):
                 "bulb_turned_off": "Ampoule éteinte",
                 "bulb_control_failed": "Échec du contrôle de l'ampoule",
                 "color_meanings_title": "🎨 SIGNIFICATION DES COULEURS:",
-                "critical_low_color": "🔴 ROUGE: Critiquement Bas (<{}) - Urgence!",
-                "low_color": "🟣 ROSE: Bas ({}-{}) - Attention nécessaire!",
-                "normal_color": "🟢 VERT: Normal ({}-{}) - Tout va bien!",
-                "high_color": "🟡 JAUNE: Élevé (> {}) - Attention nécessaire!",
+                "band_below": "moins de {}",
+                "band_above": "{} et plus",
             },
             'eu': {
                 "start_monitoring": "Monitorizazioa hasi",
@@ -293,6 +2782,13 @@ class DiabuddyBulb(toga.App):
                 "critical_low_label": "Kritikoki Baxua:",
                 "low_label": "Baxua:",
                 "high_label": "Altua:",
+                "nightscout_label": "Nightscout:",
+                "push_label": "xDrip+ek bidalitako irakurketak jaso",
+                "push_secret_label": "Sekretua",
+                "push_secret_placeholder": "Gaitzean sortzen da",
+                "gradient_label": "Kolore-gradiente jarraitua",
+                "client_effects_label": "Aplikaziotik keinu egin efekturik gabeko bonbiletan",
+                "units_label": "Unitateak:",
                 "bulb_connected": "💡 Bonbilla: konektatua",
                 "bulb_failed": "💡 Bonbilla: konexio okerra",
                 "status_ready": "Prest",
@@ -303,7 +2799,7 @@ class DiabuddyBulb(toga.App):
                 "status_check_failed": "Egiaztapenak huts egin du",
                 "bulb_on": "Bonbilla: Piztuta",
                 "bulb_off": "Bonbilla: Itzalita",
-                "alert_critical_low": "🔴 KRITIKOKI BAXUA",
+                "alert_critical": "🔴 KRITIKOKI BAXUA",
                 "alert_low": "🟣 BAXUA",
                 "alert_normal": "🟢 NORMALA",
                 "alert_high": "🟡 ALTUA",
@@ -313,6 +2809,8 @@ class DiabuddyBulb(toga.App):
                 "monitoring_stopped": "Geldiarazitako monitorizazioa",
                 "connections_working": "✅ Konexioak funtzionatzen!",
                 "check_complete": "Egiaztapen osoa: {}",
+                "check_bulb_not_connected": "Glukosa: {} (Bonbila ez dago konektatuta)",
+                "check_configure_bulb": "Glukosa: {} (Konfiguratu bonbila Ezarpenetan)",
                 "language_changed": "Hizkuntza {} ra aldatu da",
                 "start_monitoring_first": "Mesedez, hasi monitorizazioa",
                 "could_not_get_glucose": "❌ Ezin izan da glukosa-irakurketa lortu",
@@ -321,10 +2819,8 @@ class DiabuddyBulb(toga.App):
                 "bulb_turned_off": "Bonbilla itzalita",
                 "bulb_control_failed": "Bonbilla kontrolatzean huts egin da",
                 "color_meanings_title": "🎨 KOLOREEN ESANAHIA:",
-                "critical_low_color": "🔴 GORRIA: Kritikoki Baxua (<{}) - Larrialdia!",
-                "low_color": "🟣 ARROSA: Baxua ({}-{}) - Arreta behar da!",
-                "normal_color": "🟢 BERDEA: Normala ({}-{}) - Dena ondo!",
-                "high_color": "🟡 HORIA: Altua (> {}) - Arreta behar da!",
+                "band_below": "{} baino gutxiago",
+                "band_above": "{} edo gehiago",
             }
         }
     
@@ -344,6 +2840,11 @@ class DiabuddyBulb(toga.App):
     def startup(self):
         # Load settings first
         self.load_settings()
+        self.data_source = self.create_data_source()
+
+        # Restore glucose history saved before the app was last stopped
+        self.load_history()
+        self.preload_icons()
         
         # Create main window
         self.main_window = toga.MainWindow(title=self.formal_name)
@@ -382,21 +2883,58 @@ class DiabuddyBulb(toga.App):
 
     def get_icon_for_status(self, status):
         """Get the appropriate icon for current status"""
-        icon_map = {
-            "ready": "icon_ready.png",
-            "critical": "icon_critical.png",
-            "low": "icon_low.png", 
-            "normal": "icon_normal.png",
-            "high": "icon_high.png"
-        }
-        return icon_map.get(status, "icon_ready.png")
+        band = self.bands.by_name.get(status)
+        return self.get_icon_image(band.icon if band else "icon_ready.png")
+
+    def get_icon_image(self, filename):
+        """Get a decoded icon, loading it from disk only the first time"""
+        image = self.icon_images.get(filename)
+        if image is None:
+            try:
+                image = toga.Image(filename)
+            except Exception as e:
+                print(f"Error loading icon {filename}: {e}")
+                return filename
+            self.icon_images[filename] = image
+        return image
+
+    def preload_icons(self):
+        """Decode the icons of all bands up front, so status changes never touch the disk"""
+        self.get_icon_image("icon_ready.png")
+        for band in self.bands.bands:
+            self.get_icon_image(band.icon)
+
+    def get_alert_text(self, alert_level):
+        """Get the display text for a band"""
+        key = f"alert_{alert_level}"
+        text = self.t(key)
+        if text == key:
+            band = self.bands.by_name.get(alert_level)
+            return band.label or alert_level if band else alert_level
+        return text
+
+    def format_glucose(self, glucose_value, units=None):
+        """Format a mg/dL value in the display units"""
+        if (units or self.glucose_units) == "mmol/L":
+            return f"{glucose_value / BandTable.MGDL_PER_MMOL:.1f}"
+        return str(glucose_value)
+
+    def parse_glucose(self, text, units=None):
+        """Parse a value typed in the display units into whole mg/dL"""
+        if (units or self.glucose_units) == "mmol/L":
+            return int(round(float(text.strip().replace(",", ".")) * BandTable.MGDL_PER_MMOL))
+        return int(text)
 
     def build_main_ui(self):
-        """Build the main UI components"""
-        # Clear existing content
-        if self.main_box.children:
-            self.main_box.remove(*self.main_box.children)
-        
+        """Build the main UI components
+
+        The widgets are built once. Showing settings and changing language
+        only update the existing widgets (see toggle_settings and
+        update_language).
+        """
+        # Widgets whose text is a plain translation, as (widget, key)
+        self.translated_widgets = []
+
         # Header with icon and title
         header_box = toga.Box(
             style=Pack(
@@ -462,12 +3000,11 @@ class DiabuddyBulb(toga.App):
             )
         )
         
-        status_text = self.t("status_ready")
-        if self.is_monitoring:
-            status_text = self.t("status_monitoring")
-            
+        # The status message shown is kept as (key, band, suffix) so a
+        # language change shows the same message (see set_alert_status)
+        self.alert_status_message = ("status_monitoring" if self.is_monitoring else "status_ready", None, "")
         self.alert_status = toga.Label(
-            self.t("alert_status", status_text),
+            self.get_alert_status_text(),
             style=Pack(
                 padding_bottom=10, 
                 font_size=18, 
@@ -477,10 +3014,11 @@ class DiabuddyBulb(toga.App):
             )
         )
         
-        # Bulb status with on/off state
-        bulb_status_text = self.t("bulb_on") if self.bulb_is_on else self.t("bulb_off")
+        # Bulb status with on/off state. The key of the message shown is kept
+        # so a language change shows the same state (see set_bulb_status)
+        self.bulb_status_key = "bulb_on" if self.bulb_is_on else "bulb_off"
         self.bulb_status = toga.Label(
-            bulb_status_text,
+            self.t(self.bulb_status_key),
             style=Pack(
                 font_size=14, 
                 text_align="center", 
@@ -495,6 +3033,14 @@ class DiabuddyBulb(toga.App):
         status_box.add(self.bulb_status)
         
         self.main_box.add(status_box)
+
+        self.status_view.bind("icon", self.status_icon, "image")
+        self.status_view.bind("glucose", self.glucose_status, "text")
+        self.status_view.bind("direction", self.direction_status, "text")
+        self.status_view.bind("alert", self.alert_status, "text")
+        self.status_view.bind("alert_color", self.alert_status.style, "color")
+        self.status_view.bind("bulb", self.bulb_status, "text")
+        self.status_view.bind("bulb_color", self.bulb_status.style, "color")
         
         # Control Buttons - REORDERED: Settings is now under Bulb and Help
         button_box = toga.Box(
@@ -521,7 +3067,7 @@ class DiabuddyBulb(toga.App):
                 padding_bottom=10
             )
         )
-        check_btn = toga.Button(
+        check_btn = self.translated(toga.Button(
             self.t("check_now"),
             on_press=self.check_now,
             style=Pack(
@@ -533,7 +3079,7 @@ class DiabuddyBulb(toga.App):
                 padding_top=10,
                 padding_bottom=10
             )
-        )
+        ), "check_now")
         monitor_row.add(self.monitor_btn)
         monitor_row.add(check_btn)
         
@@ -553,7 +3099,7 @@ class DiabuddyBulb(toga.App):
                 padding_bottom=10
             )
         )
-        help_btn = toga.Button(
+        help_btn = self.translated(toga.Button(
             self.t("help_button"),
             on_press=self.show_about,
             style=Pack(
@@ -565,7 +3111,7 @@ class DiabuddyBulb(toga.App):
                 padding_top=10,
                 padding_bottom=10
             )
-        )
+        ), "help_button")
         bulb_help_row.add(self.bulb_btn)
         bulb_help_row.add(help_btn)
         
@@ -590,9 +3136,13 @@ class DiabuddyBulb(toga.App):
         
         self.main_box.add(button_box)
         
-        # Add settings section if visible
-        if self.settings_visible:
-            self.add_settings_section()
+        # Settings section, hidden until the settings button is pressed
+        self.add_settings_section()
+
+    def translated(self, widget, key):
+        """Remember a widget whose text is the translation of key"""
+        self.translated_widgets.append((widget, key))
+        return widget
 
     def add_settings_section(self):
         """Add settings section to UI"""
@@ -600,11 +3150,13 @@ class DiabuddyBulb(toga.App):
             style=Pack(
                 direction=COLUMN, 
                 padding=20, 
-                background_color=self.colors["cream"]
+                background_color=self.colors["cream"],
+                display="pack" if self.settings_visible else "none"
             )
         )
+        self.settings_section = settings_section
     
-        settings_title = toga.Label(
+        settings_title = self.translated(toga.Label(
             self.t("settings_title"),
             style=Pack(
                 padding_bottom=15, 
@@ -613,14 +3165,14 @@ class DiabuddyBulb(toga.App):
                 color=self.colors["dark_blue"],
                 font_family="sans-serif"
             )
-        )
+        ), "settings_title")
     
         # Email
         email_box = toga.Box(style=Pack(direction=ROW, padding_bottom=10))
-        email_box.add(toga.Label(
-            self.t("email_label"), 
+        email_box.add(self.translated(toga.Label(
+            self.t("email_label"),
             style=Pack(width=80, color=self.colors["dark_blue"], font_family="sans-serif")
-        ))
+        ), "email_label"))
         self.email_input = toga.TextInput(
             value=self.tapo_email,
             placeholder="your@email.com",
@@ -630,10 +3182,10 @@ class DiabuddyBulb(toga.App):
     
         # Password
         password_box = toga.Box(style=Pack(direction=ROW, padding_bottom=10))
-        password_box.add(toga.Label(
-            self.t("password_label"), 
+        password_box.add(self.translated(toga.Label(
+            self.t("password_label"),
             style=Pack(width=80, color=self.colors["dark_blue"], font_family="sans-serif")
-        ))
+        ), "password_label"))
         self.password_input = toga.PasswordInput(
             value=self.tapo_password,
             placeholder="Tapo password",
@@ -643,19 +3195,72 @@ class DiabuddyBulb(toga.App):
     
         # IP Address
         ip_box = toga.Box(style=Pack(direction=ROW, padding_bottom=20))
-        ip_box.add(toga.Label(
-            self.t("ip_label"), 
+        ip_box.add(self.translated(toga.Label(
+            self.t("ip_label"),
             style=Pack(width=80, color=self.colors["dark_blue"], font_family="sans-serif")
-        ))
+        ), "ip_label"))
         self.ip_input = toga.TextInput(
             value=self.tapo_ip,
             placeholder="192.168.1.100",
             style=Pack(flex=1)
         )
         ip_box.add(self.ip_input)
+
+        # Nightscout server (optional)
+        nightscout_box = toga.Box(style=Pack(direction=ROW, padding_bottom=20))
+        nightscout_box.add(self.translated(toga.Label(
+            self.t("nightscout_label"),
+            style=Pack(width=80, color=self.colors["dark_blue"], font_family="sans-serif")
+        ), "nightscout_label"))
+        self.nightscout_input = toga.TextInput(
+            value=self.nightscout_url,
+            placeholder="https://",
+            style=Pack(flex=1)
+        )
+        nightscout_box.add(self.nightscout_input)
+
+        # Push receiver
+        push_box = toga.Box(style=Pack(direction=ROW, padding_bottom=20))
+        self.push_switch = self.translated(toga.Switch(
+            self.t("push_label"),
+            value=self.push_enabled,
+            style=Pack(flex=1, color=self.colors["dark_blue"], font_family="sans-serif")
+        ), "push_label")
+        push_box.add(self.push_switch)
+
+        # Secret xDrip+ must send with uploads (http://secret@127.0.0.1:17581/api/v1/)
+        push_secret_box = toga.Box(style=Pack(direction=ROW, padding_bottom=20))
+        push_secret_box.add(self.translated(toga.Label(
+            self.t("push_secret_label"),
+            style=Pack(width=80, color=self.colors["dark_blue"], font_family="sans-serif")
+        ), "push_secret_label"))
+        self.push_secret_input = toga.TextInput(
+            value=self.push_secret,
+            placeholder=self.t("push_secret_placeholder"),
+            style=Pack(flex=1)
+        )
+        push_secret_box.add(self.push_secret_input)
+
+        # Color mode
+        gradient_box = toga.Box(style=Pack(direction=ROW, padding_bottom=20))
+        self.gradient_switch = self.translated(toga.Switch(
+            self.t("gradient_label"),
+            value=self.color_mode == "gradient",
+            style=Pack(flex=1, color=self.colors["dark_blue"], font_family="sans-serif")
+        ), "gradient_label")
+        gradient_box.add(self.gradient_switch)
+
+        # App-driven flashing for bulbs without light effects
+        client_effects_box = toga.Box(style=Pack(direction=ROW, padding_bottom=20))
+        self.client_effects_switch = self.translated(toga.Switch(
+            self.t("client_effects_label"),
+            value=self.client_effects,
+            style=Pack(flex=1, color=self.colors["dark_blue"], font_family="sans-serif")
+        ), "client_effects_label")
+        client_effects_box.add(self.client_effects_switch)
         
         # Glucose Thresholds Section
-        thresholds_title = toga.Label(
+        thresholds_title = self.translated(toga.Label(
             self.t("thresholds_title"),
             style=Pack(
                 padding_bottom=10, 
@@ -664,17 +3269,34 @@ class DiabuddyBulb(toga.App):
                 color=self.colors["dark_blue"],
                 font_family="sans-serif"
             )
-        )
+        ), "thresholds_title")
         settings_section.add(thresholds_title)
+
+        # Units for readings and the thresholds below
+        units_box = toga.Box(style=Pack(direction=ROW, padding_bottom=10))
+        units_box.add(self.translated(toga.Label(
+            self.t("units_label"),
+            style=Pack(width=100, color=self.colors["dark_blue"], font_family="sans-serif")
+        ), "units_label"))
+        # Units the threshold inputs currently show
+        self.threshold_input_units = self.glucose_units
+        self.units_selection = toga.Selection(
+            items=["mg/dL", "mmol/L"],
+            value=self.glucose_units,
+            on_change=self.change_threshold_units,
+            style=Pack(flex=1)
+        )
+        units_box.add(self.units_selection)
+        settings_section.add(units_box)
         
         # Critical Low Threshold
         critical_low_box = toga.Box(style=Pack(direction=ROW, padding_bottom=10))
-        critical_low_box.add(toga.Label(
-            self.t("critical_low_label"), 
+        critical_low_box.add(self.translated(toga.Label(
+            self.t("critical_low_label"),
             style=Pack(width=100, color=self.colors["dark_blue"], font_family="sans-serif")
-        ))
+        ), "critical_low_label"))
         self.critical_low_input = toga.TextInput(
-            value=str(self.critical_low_threshold),
+            value=self.format_glucose(self.critical_low_threshold),
             placeholder="50",
             style=Pack(flex=1)
         )
@@ -682,12 +3304,12 @@ class DiabuddyBulb(toga.App):
         
         # Low Threshold
         low_box = toga.Box(style=Pack(direction=ROW, padding_bottom=10))
-        low_box.add(toga.Label(
-            self.t("low_label"), 
+        low_box.add(self.translated(toga.Label(
+            self.t("low_label"),
             style=Pack(width=100, color=self.colors["dark_blue"], font_family="sans-serif")
-        ))
+        ), "low_label"))
         self.low_input = toga.TextInput(
-            value=str(self.low_threshold),
+            value=self.format_glucose(self.low_threshold),
             placeholder="70",
             style=Pack(flex=1)
         )
@@ -695,12 +3317,12 @@ class DiabuddyBulb(toga.App):
         
         # High Threshold
         high_box = toga.Box(style=Pack(direction=ROW, padding_bottom=20))
-        high_box.add(toga.Label(
-            self.t("high_label"), 
+        high_box.add(self.translated(toga.Label(
+            self.t("high_label"),
             style=Pack(width=100, color=self.colors["dark_blue"], font_family="sans-serif")
-        ))
+        ), "high_label"))
         self.high_input = toga.TextInput(
-            value=str(self.high_threshold),
+            value=self.format_glucose(self.high_threshold),
             placeholder="180",
             style=Pack(flex=1)
         )
@@ -712,10 +3334,10 @@ class DiabuddyBulb(toga.App):
     
         # Language selector - 2-column layout
         language_box = toga.Box(style=Pack(direction=COLUMN, padding_bottom=20))
-        language_label = toga.Label(
+        language_label = self.translated(toga.Label(
             self.t("language_label"),
             style=Pack(padding_bottom=10, color=self.colors["dark_blue"], font_family="sans-serif")
-        )
+        ), "language_label")
         language_box.add(language_label)
     
         # Create two columns for language buttons
@@ -725,6 +3347,8 @@ class DiabuddyBulb(toga.App):
         languages_list = list(self.languages.items())
         mid_point = (len(languages_list) + 1) // 2
     
+        # Language buttons by code, so only their colors change on selection
+        self.language_buttons = {}
         left_column = toga.Box(style=Pack(direction=COLUMN, flex=1, padding_right=5))
         right_column = toga.Box(style=Pack(direction=COLUMN, flex=1, padding_left=5))
     
@@ -743,6 +3367,7 @@ class DiabuddyBulb(toga.App):
                 )
             )
             lang_btn.language_code = lang_code
+            self.language_buttons[lang_code] = lang_btn
             left_column.add(lang_btn)
     
         # Add buttons to right column
@@ -760,6 +3385,7 @@ class DiabuddyBulb(toga.App):
                 )
             )
             lang_btn.language_code = lang_code
+            self.language_buttons[lang_code] = lang_btn
             right_column.add(lang_btn)
     
         language_columns.add(left_column)
@@ -768,7 +3394,7 @@ class DiabuddyBulb(toga.App):
     
         # Test and Save buttons
         test_save_row = toga.Box(style=Pack(direction=ROW, padding_bottom=5))
-        test_btn = toga.Button(
+        test_btn = self.translated(toga.Button(
             self.t("test_connections"),
             on_press=self.test_connections,
             style=Pack(
@@ -780,8 +3406,8 @@ class DiabuddyBulb(toga.App):
                 padding_top=10,
                 padding_bottom=10
             )
-        )
-        save_btn = toga.Button(
+        ), "test_connections")
+        save_btn = self.translated(toga.Button(
             self.t("save_settings"),
             on_press=self.save_settings,
             style=Pack(
@@ -793,7 +3419,7 @@ class DiabuddyBulb(toga.App):
                 padding_top=10,
                 padding_bottom=10
             )
-        )
+        ), "save_settings")
         test_save_row.add(test_btn)
         test_save_row.add(save_btn)
     
@@ -802,6 +3428,11 @@ class DiabuddyBulb(toga.App):
         settings_section.add(email_box)
         settings_section.add(password_box)
         settings_section.add(ip_box)
+        settings_section.add(nightscout_box)
+        settings_section.add(push_box)
+        settings_section.add(push_secret_box)
+        settings_section.add(gradient_box)
+        settings_section.add(client_effects_box)
         settings_section.add(language_box)
         settings_section.add(test_save_row)
     
@@ -815,8 +3446,8 @@ class DiabuddyBulb(toga.App):
         # Save settings
         self.save_settings_to_file()
         
-        # Rebuild UI with new language
-        self.build_main_ui()
+        # Only the text of the existing widgets changes
+        self.update_language()
         
         # Show confirmation
         lang_name = self.languages.get(self.current_language, self.current_language)
@@ -840,9 +3471,82 @@ class DiabuddyBulb(toga.App):
                         self.critical_low_threshold = settings.get('critical_low_threshold', 50)
                         self.low_threshold = settings.get('low_threshold', 70)
                         self.high_threshold = settings.get('high_threshold', 180)
+                        self.prediction_lead = settings.get('prediction_lead', 15)
+                        self.hysteresis_margin = settings.get('hysteresis_margin', 3)
+                        self.min_dwell = settings.get('min_dwell', 10)
+                        self.smoothing = settings.get('smoothing', 0.0)
+                        # Load glucose bands
+                        self.glucose_units = settings.get('glucose_units', 'mg/dL')
+                        self.custom_bands = settings.get('bands')
+                        self.rebuild_bands()
+                        self.color_mode = settings.get('color_mode', 'bands')
+                        self.gradient_trend = settings.get('gradient_trend', 10)
+                        self.client_effects = settings.get('client_effects', False)
+                        self.bulb_queue.effects.client_fallback = self.client_effects
+                        # Load push receiver settings
+                        self.push_enabled = settings.get('push_enabled', False)
+                        # Load alert settings
+                        self.alert_cooldown = settings.get('alert_cooldown', 15)
+                        self.alert_cooldowns = settings.get('alert_cooldowns', self.alert_cooldowns)
+                        self.update_alert_cooldowns()
+                        self.push_port = settings.get('push_port', 17581)
+                        self.push_secret = settings.get('push_secret', '')
+                        # Load data source settings
+                        self.nightscout_url = settings.get('nightscout_url', '')
+                        self.nightscout_secret = settings.get('nightscout_secret', '')
         except Exception as e:
             print(f"Error loading settings: {e}")
 
+    def create_data_source(self):
+        """Create the configured data source, keeping the current history"""
+        history = self.data_source.history
+        keepalive_timeout = self.get_keepalive_timeout()
+        if self.nightscout_url:
+            return NightscoutClient(
+                self.nightscout_url, api_secret=self.nightscout_secret,
+                history=history, keepalive_timeout=keepalive_timeout
+            )
+        return XDripClient(history=history, keepalive_timeout=keepalive_timeout)
+
+    def get_keepalive_timeout(self):
+        """Get how long idle connections should outlive the gap between polls
+
+        Polls follow the sensor cadence, so a connection kept for one reading
+        interval plus the wake delay is still open for the next poll. Skipped
+        readings and the slower watchdog polls while pushes arrive reconnect.
+        """
+        return int(self.scheduler.reading_interval + self.scheduler.wake_delay + 30)
+
+    async def switch_data_source(self):
+        """Replace the data source after its settings changed"""
+        old_source = self.data_source
+        self.data_source = self.create_data_source()
+        self.update_stream()
+        await old_source.close()
+
+    def update_stream(self):
+        """Start or stop streaming updates to match the monitoring state and source"""
+        if self.stream_task is not None:
+            self.stream_task.cancel()
+            self.stream_task = None
+        if self.is_monitoring and self.data_source.supports_streaming:
+            self.stream_task = asyncio.create_task(
+                self.data_source.stream(self.handle_incoming_readings)
+            )
+
+    def load_history(self):
+        """Restore glucose history from file and keep saving new readings to it"""
+        try:
+            if hasattr(self, 'app'):
+                history_file = os.path.join(self.app.paths.data, 'glucose_history.bin')
+                self.history_log = HistoryLog(history_file)
+                history = self.data_source.history
+                history.log = None
+                self.history_log.restore(history)
+                history.log = self.history_log
+        except Exception as e:
+            print(f"Error loading glucose history: {e}")
+
     def save_settings_to_file(self):
         """Save settings to file"""
         try:
@@ -858,7 +3562,27 @@ class DiabuddyBulb(toga.App):
                     # Save glucose thresholds
                     'critical_low_threshold': self.critical_low_threshold,
                     'low_threshold': self.low_threshold,
-                    'high_threshold': self.high_threshold
+                    'high_threshold': self.high_threshold,
+                    'prediction_lead': self.prediction_lead,
+                    'hysteresis_margin': self.hysteresis_margin,
+                    'min_dwell': self.min_dwell,
+                    'smoothing': self.smoothing,
+                    # Save glucose bands
+                    'glucose_units': self.glucose_units,
+                    'bands': self.custom_bands,
+                    'color_mode': self.color_mode,
+                    'gradient_trend': self.gradient_trend,
+                    'client_effects': self.client_effects,
+                    # Save push receiver settings
+                    'push_enabled': self.push_enabled,
+                    # Save alert settings
+                    'alert_cooldown': self.alert_cooldown,
+                    'alert_cooldowns': self.alert_cooldowns,
+                    'push_port': self.push_port,
+                    'push_secret': self.push_secret,
+                    # Save data source settings
+                    'nightscout_url': self.nightscout_url,
+                    'nightscout_secret': self.nightscout_secret
                 }
                 
                 os.makedirs(app_dir, exist_ok=True)
@@ -868,10 +3592,82 @@ class DiabuddyBulb(toga.App):
         except Exception as e:
             print(f"Error saving settings to file: {e}")
 
+    def update_language(self):
+        """Update widget text after a language change"""
+        for widget, key in self.translated_widgets:
+            widget.text = self.t(key)
+
+        # Text that depends on the current state
+        self.monitor_btn.text = self.t("stop_monitoring") if self.is_monitoring else self.t("start_monitoring")
+        self.bulb_btn.text = self.t("turn_bulb_off") if self.bulb_is_on else self.t("turn_bulb_on")
+        self.status_view.set("bulb", self.t(self.bulb_status_key))
+        self.push_secret_input.placeholder = self.t("push_secret_placeholder")
+        self.settings_btn.text = self.t("hide_settings") if self.settings_visible else self.t("show_settings")
+        self.status_view.set("alert", self.get_alert_status_text())
+        if self.last_status is not None:
+            glucose_value, direction, alert_level = self.last_status
+            self.status_view.set("glucose", self.t("glucose_status", self.format_glucose(glucose_value)))
+            self.status_view.set("direction", self.t("direction_status", self.get_direction_arrow(direction)))
+
+        for lang_code, lang_btn in self.language_buttons.items():
+            selected = lang_code == self.current_language
+            lang_btn.style.background_color = self.colors["dark_blue"] if selected else self.colors["yellow"]
+            lang_btn.style.color = self.colors["cream"] if selected else self.colors["dark_blue"]
+
+    def set_alert_status(self, key, band=None, suffix=""):
+        """Show a status message, or the alert text of a band when one is given"""
+        self.alert_status_message = (key, band, suffix)
+        self.status_view.set("alert", self.get_alert_status_text())
+
+    def get_alert_status_text(self):
+        """Get the status message shown, in the current language"""
+        key, band, suffix = self.alert_status_message
+        text = self.get_alert_text(band) if band else self.t(key)
+        return self.t("alert_status", text) + suffix
+
+    def set_bulb_status(self, key):
+        """Show a bulb state message (connected, failed, on or off)"""
+        self.bulb_status_key = key
+        self.status_view.set("bulb", self.t(key))
+
+    def reset_settings_inputs(self):
+        """Show the saved settings in the settings inputs, dropping unsaved edits"""
+        self.email_input.value = self.tapo_email
+        self.password_input.value = self.tapo_password
+        self.ip_input.value = self.tapo_ip
+        self.nightscout_input.value = self.nightscout_url
+        self.push_switch.value = self.push_enabled
+        self.push_secret_input.value = self.push_secret
+        self.gradient_switch.value = self.color_mode == "gradient"
+        self.client_effects_switch.value = self.client_effects
+        # Set the units first so changing them doesn't convert the old inputs
+        self.threshold_input_units = self.glucose_units
+        self.units_selection.value = self.glucose_units
+        self.critical_low_input.value = self.format_glucose(self.critical_low_threshold)
+        self.low_input.value = self.format_glucose(self.low_threshold)
+        self.high_input.value = self.format_glucose(self.high_threshold)
+
+    def change_threshold_units(self, widget):
+        """Show the threshold inputs in the newly selected units"""
+        units = widget.value
+        if units == self.threshold_input_units:
+            return
+        for threshold_input in (self.critical_low_input, self.low_input, self.high_input):
+            try:
+                value = self.parse_glucose(threshold_input.value, self.threshold_input_units)
+            except ValueError:
+                # Leave half-typed values for the user to fix
+                continue
+            threshold_input.value = self.format_glucose(value, units)
+        self.threshold_input_units = units
+
     def toggle_settings(self, widget):
         """Toggle settings section visibility"""
         self.settings_visible = not self.settings_visible
-        self.build_main_ui()
+        if self.settings_visible:
+            self.reset_settings_inputs()
+        self.settings_section.style.display = "pack" if self.settings_visible else "none"
+        self.settings_btn.text = self.t("hide_settings") if self.settings_visible else self.t("show_settings")
     
     def toggle_bulb(self, widget):
         """Toggle bulb on/off"""
@@ -886,15 +3682,19 @@ class DiabuddyBulb(toga.App):
                 
             try:
                 if self.bulb_is_on:
-                    await self.tapo_device.turn_off()
+                    # Queued colors would only be thrown away by the bulb
+                    self.bulb_queue.cancel("color")
+                    if await self.bulb_queue.set_power(False) is None:
+                        raise ValueError("Bulb command dropped")
                     self.bulb_is_on = False
-                    self.bulb_status.text = self.t("bulb_off")
+                    self.set_bulb_status("bulb_off")
                     self.bulb_btn.text = self.t("turn_bulb_on")
                     self.show_alert("✅ " + self.t("bulb_turned_off"))
                 else:
-                    await self.tapo_device.turn_on()
+                    if await self.bulb_queue.set_power(True) is None:
+                        raise ValueError("Bulb command dropped")
                     self.bulb_is_on = True
-                    self.bulb_status.text = self.t("bulb_on")
+                    self.set_bulb_status("bulb_on")
                     self.bulb_btn.text = self.t("turn_bulb_off")
                     self.show_alert("✅ " + self.t("bulb_turned_on"))
                     
@@ -909,16 +3709,37 @@ class DiabuddyBulb(toga.App):
         about_text = self.get_about_text()
         self.main_window.info_dialog("📖 " + self.t("help_button").replace("❓ ", ""), about_text)
     
+    def get_band_descriptions(self):
+        """Describe each band and its range in the display units, lowest first"""
+        bands = self.bands.bands
+        mgdl = self.glucose_units != "mmol/L"
+        descriptions = []
+        for index, band in enumerate(bands):
+            lower = band.lower
+            upper = bands[index + 1].lower if index + 1 < len(bands) else None
+            if lower is None and upper is None:
+                continue
+            if mgdl:
+                # Whole mg/dL, as the band table rounds them
+                lower = None if lower is None else int(math.ceil(lower))
+                upper = None if upper is None else int(math.ceil(upper))
+            if lower is None:
+                value_range = self.t("band_below", f"{self.format_glucose(upper)} {self.glucose_units}")
+            elif upper is None:
+                value_range = self.t("band_above", f"{self.format_glucose(lower)} {self.glucose_units}")
+            else:
+                # mmol/L ranges are written with shared bounds (3.9-10.0, 10.0 and above)
+                last = upper - 1 if mgdl else upper
+                value_range = f"{self.format_glucose(lower)}-{self.format_glucose(last)} {self.glucose_units}"
+            descriptions.append(f"{self.get_alert_text(band.name)}: {value_range}")
+        return descriptions
+
     def get_about_text(self):
         """Get about text in current language"""
-        # Build color meanings using translations
-        thresholds_info = f"""
-{self.t("color_meanings_title")}
-{self.t("critical_low_color", self.critical_low_threshold)}
-{self.t("low_color", self.critical_low_threshold, self.low_threshold)}
-{self.t("normal_color", self.low_threshold, self.high_threshold)}
-{self.t("high_color", self.high_threshold)}
-"""
+        # Build color meanings from the bands actually in use
+        thresholds_info = "\n".join(
+            [self.t("color_meanings_title")] + self.get_band_descriptions()
+        )
         
         if self.current_language == 'es':
             return f"""
@@ -926,7 +3747,7 @@ class DiabuddyBulb(toga.App):
 • Se conecta a xDrip+ para obtener lecturas de glucosa
 • Cambia el color de tu bombilla Tapo según los niveles de glucosa
 • Proporciona alertas visuales para niveles bajos y altos
-• Se actualiza automáticamente cada 100 segundos
+• Se actualiza automáticamente tras cada nueva lectura del sensor
 • Control manual de encendido/apagado de la bombilla
 
 {thresholds_info}
@@ -981,7 +3802,7 @@ Versión 0.0.1 - Hecho con ❤️ para familias con diabetes
 • Se connecte à xDrip+ pour obtenir les lectures de glucose
 • Change la couleur de votre ampoule Tapo en fonction des niveaux de glucose
 • Fournit des alertes visuelles pour les niveaux bas et élevés
-• Se met à jour automatiquement toutes les 100 secondes
+• Se met à jour automatiquement après chaque nouvelle lecture du capteur
 • Contrôle manuel de l'allumage/extinction de l'ampoule
 
 {thresholds_info}
@@ -1036,7 +3857,7 @@ Version 0.0.1 - Fait avec ❤️ pour les familles diabétiques
 • xDrip+era konektatzen da glukosa-irakurketak lortzeko
 • Zure Tapo bonbillaren kolorea aldatzen du glukosa mailen arabera
 • Alerta bisualak ematen ditu maila baxu eta altuetarako
-• Automatikoki eguneratzen da 100 segundotik behin
+• Automatikoki eguneratzen da sentsorearen irakurketa berri bakoitzaren ondoren
 • Bonbillaren pizte eta itzaltzearen kontrola
 
 {thresholds_info}
@@ -1091,7 +3912,7 @@ Version 0.0.1 - Fait avec ❤️ pour les familles diabétiques
 • Connects to xDrip+ to get glucose readings
 • Changes your Tapo bulb color based on glucose levels
 • Provides visual alerts for lows and highs
-• Updates automatically every 100 seconds
+• Updates automatically right after each new sensor reading
 • Manual bulb on/off control
 
 {thresholds_info}
@@ -1144,29 +3965,77 @@ Version 0.0.1 - Made with ❤️ for diabetes families
     def show_alert(self, message, is_error=False):
         """Show alert dialog"""
         title = "⚠️ Alert" if is_error else "💡 Info"
-        self.main_window.info_dialog(title, message)
+        # Queued, so dialogs never stack and the caller never waits
+        self.alert_dispatcher.enqueue(message, 0, title, message)
+
+    async def show_dialog(self, title, message):
+        """Show a dialog and wait until it's closed"""
+        if hasattr(toga, "InfoDialog"):
+            await self.main_window.dialog(toga.InfoDialog(title, message))
+        else:
+            await self.main_window.info_dialog(title, message)
+
+    def update_alert_cooldowns(self):
+        """Pass the alert cooldown settings (minutes) to the dispatcher"""
+        self.alert_dispatcher.default_cooldown = self.alert_cooldown * 60
+        self.alert_dispatcher.cooldowns = {
+            band: minutes * 60 for band, minutes in self.alert_cooldowns.items()
+        }
     
     def update_status(self, glucose_value, direction, alert_level=""):
         """Update the status display with arrows and icon"""
-        self.glucose_status.text = self.t("glucose_status", glucose_value)
+        self.last_status = (glucose_value, direction, alert_level)
+        self.status_view.set("glucose", self.t("glucose_status", self.format_glucose(glucose_value)))
         
         # Convert direction to arrow
         arrow = self.get_direction_arrow(direction)
-        self.direction_status.text = self.t("direction_status", arrow)
+        self.status_view.set("direction", self.t("direction_status", arrow))
         
         if alert_level:
-            alert_text = self.t(f"alert_{alert_level}")
-            self.alert_status.text = self.t("alert_status", alert_text)
+            alert_text = self.get_alert_text(alert_level)
+            self.set_alert_status(None, alert_level)
             
             # Update the icon based on status
             self.current_status = alert_level
-            self.status_icon.image = self.get_icon_for_status(alert_level)
+            if not self.update_status_icon(alert_level, glucose_value, arrow):
+                self.status_view.set("icon", self.get_icon_for_status(alert_level))
             
-            if alert_level in ["critical", "low", "high"]:
-                self.show_alert(f"Glucose Alert: {glucose_value} ({alert_text})", is_error=True)
+            # Only new, more urgent or overdue alerts reach the screen
+            self.alert_dispatcher.notify_glucose(
+                alert_level,
+                self.bands.urgency.get(alert_level, 0),
+                "⚠️ Alert",
+                f"Glucose Alert: {self.format_glucose(glucose_value)} ({alert_text})",
+            )
     
+    def update_status_icon(self, alert_level, glucose_value, arrow):
+        """Show the band icon with the value and arrow drawn on
+
+        Returns False if that's not possible and the plain band icon should be used.
+        """
+        band = self.bands.by_name.get(alert_level)
+        if band is None or not self.icon_renderer.available:
+            return False
+        key = (band.name, self.format_glucose(glucose_value), arrow)
+        self.status_icon_key = key
+        image = self.icon_renderer.get(key)
+        if image is not None:
+            self.status_view.set("icon", image)
+        else:
+            asyncio.create_task(self._render_status_icon(key, band.icon))
+        return True
+
+    async def _render_status_icon(self, key, icon):
+        """Render a status icon in the background and show it if it's still wanted"""
+        image = await self.icon_renderer.render(key, icon)
+        if key != self.status_icon_key:
+            return
+        if image is None:
+            image = self.get_icon_image(icon)
+        self.status_view.set("icon", image)
+
     async def initialize_tapo(self, email=None, password=None, ip=None):
-        """Initialize Tapo connection"""
+        """Initialize Tapo connection, reusing the open session if there is one"""
         email = email or self.tapo_email
         password = password or self.tapo_password
         ip = ip or self.tapo_ip
@@ -1176,24 +4045,15 @@ Version 0.0.1 - Made with ❤️ for diabetes families
             return False
             
         try:
-            from plugp100.common.credentials import AuthCredential
-            from plugp100.new.device_factory import connect, DeviceConnectConfiguration
-            
-            credentials = AuthCredential(email, password)
-            device_configuration = DeviceConnectConfiguration(
-                host=ip,
-                credentials=credentials
-            )
-            
-            self.tapo_device = await connect(device_configuration)
-            await self.tapo_device.update()
-            self.bulb_status.text = self.t("bulb_connected")
-            self.bulb_status.style.color = self.colors["green"]
+            self.tapo.configure(email, password, ip)
+            await self.tapo.ensure_connected()
+            self.set_bulb_status("bulb_connected")
+            self.status_view.set("bulb_color", self.colors["green"])
             return True
             
         except Exception as e:
-            self.bulb_status.text = self.t("bulb_failed")
-            self.bulb_status.style.color = self.colors["red"]
+            self.set_bulb_status("bulb_failed")
+            self.status_view.set("bulb_color", self.colors["red"])
             return False
 
     def test_connections(self, widget):
@@ -1205,16 +4065,16 @@ Version 0.0.1 - Made with ❤️ for diabetes families
                 self.stop_monitoring()
                 await asyncio.sleep(1)
             
-            self.alert_status.text = self.t("alert_status", self.t("status_testing"))
-            self.alert_status.style.color = self.colors["dark_blue"]
+            self.set_alert_status("status_testing")
+            self.status_view.set("alert_color", self.colors["dark_blue"])
             
             # Test xDrip
-            glucose = await self.xdrip_client.get_latest_glucose()
+            glucose = await self.data_source.get_latest_glucose()
             xdrip_ok = glucose is not None
             
             if xdrip_ok:
-                alert_level = self.get_alert_level(glucose['value'])
-                self.update_status(glucose['value'], glucose['direction'], alert_level)
+                alert_level = self.get_reading_alert_level(glucose)
+                self.update_status(glucose.value, glucose.direction, alert_level)
             
             # Test Tapo
             tapo_ok = await self.initialize_tapo()
@@ -1222,62 +4082,72 @@ Version 0.0.1 - Made with ❤️ for diabetes families
             if tapo_ok:
                 try:
                     # Turn on and cycle through colors with matching icon changes
-                    await self.tapo_device.turn_on()
+                    if await self.bulb_queue.set_power(True) is None:
+                        raise ValueError("Bulb command dropped")
                     self.bulb_is_on = True
-                    self.bulb_status.text = self.t("bulb_on")
+                    self.set_bulb_status("bulb_on")
                     self.bulb_btn.text = self.t("turn_bulb_off")
                     
-                    # Color demo with icon changes
-                    color_sequence = [
-                        (0, 100, "critical"),    # Red - Critical
-                        (270, 100, "low"),        # Light Pink - Low
-                        (120, 100, "normal"),    # Green - Normal
-                        (60, 100, "high")        # Yellow - High
-                    ]
-                    
-                    for hue, saturation, status in color_sequence:
+                    # Color demo with icon changes, one step per band. Steps are
+                    # queued at the lowest priority so alerts always go first.
+                    self.status_icon_key = None
+                    for band in self.bands.bands:
                         # Change both bulb color and app icon
-                        await self.tapo_device.set_hue_saturation(hue, saturation)
-                        self.status_icon.image = self.get_icon_for_status(status)
+                        if band.effect in BulbEffects.EFFECTS:
+                            await self.bulb_queue.set_effect(
+                                band.effect, band.hue, band.saturation, band.brightness,
+                                priority=BulbCommandQueue.DEMO, timeout=5
+                            )
+                        else:
+                            await self.bulb_queue.set_color(
+                                band.hue, band.saturation, band.brightness,
+                                priority=BulbCommandQueue.DEMO, timeout=5
+                            )
+                        self.status_view.set("icon", self.get_icon_for_status(band.name))
                         await asyncio.sleep(1.5)
                     
                     # Set back based on current glucose or default to normal
                     if xdrip_ok:
-                        await self.update_bulb_color(glucose['value'])
-                        self.current_status = self.get_alert_level(glucose['value'])
-                        self.status_icon.image = self.get_icon_for_status(self.current_status)
+                        await self.update_bulb_color(glucose.value, alert_level)
+                        self.current_status = alert_level
+                        self.status_view.set("icon", self.get_icon_for_status(alert_level))
                     else:
-                        await self.tapo_device.set_hue_saturation(120, 100)
-                        self.status_icon.image = self.get_icon_for_status("normal")
-                        self.current_status = "normal"
+                        normal_band = self.get_normal_band()
+                        await self.bulb_queue.set_color(
+                            normal_band.hue, normal_band.saturation, normal_band.brightness,
+                            priority=BulbCommandQueue.MANUAL
+                        )
+                        self.status_view.set("icon", self.get_icon_for_status(normal_band.name))
+                        self.current_status = normal_band.name
                 
                 except Exception as e:
                     tapo_ok = False
-                    self.status_icon.image = self.get_icon_for_status("ready")
+                    self.status_view.set("icon", self.get_icon_for_status("ready"))
                     self.current_status = "ready"
             
             # Show single result dialog
             if xdrip_ok and tapo_ok:
                 self.show_alert(self.t("connections_working"))
-                self.alert_status.text = self.t("alert_status", self.t("status_ready"))
-                self.alert_status.style.color = self.colors["green"]
+                self.set_alert_status("status_ready")
+                self.status_view.set("alert_color", self.colors["green"])
             elif xdrip_ok and not tapo_ok:
                 self.show_alert("❌ Partial connection\n\nxDrip+ is working but Tapo bulb failed to connect.", is_error=True)
-                self.alert_status.text = self.t("alert_status", "xDrip+ Only")
-                self.alert_status.style.color = self.colors["orange"]
+                self.set_alert_status("xDrip+ Only")
+                self.status_view.set("alert_color", self.colors["orange"])
             elif not xdrip_ok and tapo_ok:
                 self.show_alert("❌ Partial connection\n\nTapo bulb is connected but xDrip+ failed.", is_error=True)
-                self.alert_status.text = self.t("alert_status", "Tapo Only") 
-                self.alert_status.style.color = self.colors["orange"]
+                self.set_alert_status("Tapo Only")
+                self.status_view.set("alert_color", self.colors["orange"])
             else:
                 self.show_alert("❌ Connection failed\n\nBoth xDrip+ and Tapo bulb failed to connect.", is_error=True)
-                self.alert_status.text = self.t("alert_status", "Connection Failed")
-                self.alert_status.style.color = self.colors["red"]
-                self.status_icon.image = self.get_icon_for_status("ready")
+                self.set_alert_status("Connection Failed")
+                self.status_view.set("alert_color", self.colors["red"])
+                self.status_view.set("icon", self.get_icon_for_status("ready"))
                 self.current_status = "ready"
             
             if was_monitoring:
-                self.alert_status.text += " - Restart"
+                key, band, _ = self.alert_status_message
+                self.set_alert_status(key, band, " - Restart")
         
         asyncio.create_task(_test_connections())
     
@@ -1288,67 +4158,181 @@ Version 0.0.1 - Made with ❤️ for diabetes families
                 self.show_alert(self.t("start_monitoring_first"), is_error=True)
                 return
                 
-            self.alert_status.text = self.t("alert_status", self.t("status_checking"))
-            self.alert_status.style.color = self.colors["dark_blue"]
+            self.set_alert_status("status_checking")
+            self.status_view.set("alert_color", self.colors["dark_blue"])
             
-            glucose = await self.xdrip_client.get_latest_glucose()
+            glucose = await self.data_source.get_latest_glucose()
             if glucose:
-                alert_level = self.get_alert_level(glucose['value'])
-                self.update_status(glucose['value'], glucose['direction'], alert_level)
+                alert_level = self.get_reading_alert_level(glucose)
+                self.update_status(glucose.value, glucose.direction, alert_level)
                 
                 if all([self.tapo_email, self.tapo_password, self.tapo_ip]):
                     if await self.initialize_tapo():
-                        await self.update_bulb_color(glucose['value'])
-                        self.show_alert("✅ " + self.t("check_complete", glucose['value']))
+                        await self.update_bulb_color(glucose.value, alert_level)
+                        self.show_alert("✅ " + self.t("check_complete", self.format_glucose(glucose.value)))
                     else:
-                        self.show_alert(f"Glucose: {glucose['value']} (Bulb not connected)")
+                        self.show_alert(self.t("check_bulb_not_connected", self.format_glucose(glucose.value)))
                 else:
-                    self.show_alert(f"Glucose: {glucose['value']} (Configure bulb in Settings)")
+                    self.show_alert(self.t("check_configure_bulb", self.format_glucose(glucose.value)))
             else:
-                self.alert_status.text = self.t("alert_status", self.t("status_check_failed"))
-                self.alert_status.style.color = self.colors["red"]
+                self.set_alert_status("status_check_failed")
+                self.status_view.set("alert_color", self.colors["red"])
                 self.show_alert(self.t("could_not_get_glucose"), is_error=True)
         
         asyncio.create_task(_check_now())
     
     def get_alert_level(self, glucose_value):
-        """Determine alert level using customizable thresholds"""
-        if glucose_value < self.critical_low_threshold:
-            return "critical"
-        elif glucose_value < self.low_threshold:
-            return "low"
-        elif glucose_value <= self.high_threshold:
-            return "normal"
-        else:
-            return "high"
+        """Determine alert level (band name) using the compiled band table"""
+        return self.bands.level_for(glucose_value)
+
+    def get_normal_band(self):
+        """Get the in-range band"""
+        for band in self.bands.bands:
+            if band.urgency == 0:
+                return band
+        return self.bands.bands[0]
+
+    def rebuild_bands(self):
+        """Recompile the band table after the band or threshold settings changed"""
+        try:
+            if self.custom_bands:
+                self.bands = BandTable.from_settings(self.custom_bands, self.glucose_units)
+            else:
+                self.bands = BandTable.from_thresholds(
+                    self.critical_low_threshold, self.low_threshold, self.high_threshold
+                )
+        except Exception as e:
+            print(f"Error in glucose band settings: {e}")
+            self.bands = BandTable.from_thresholds(
+                self.critical_low_threshold, self.low_threshold, self.high_threshold
+            )
+        self.classifier = self.create_classifier()
+        self.icon_renderer.clear()
     
+    def get_predicted_alert_level(self, glucose_value):
+        """Get the alert level, moving to an alert early if the trend is heading into it"""
+        alert_level = self.get_alert_level(glucose_value)
+        if not self.prediction_lead:
+            return alert_level
+
+        prediction = self.predictor.fit(
+            self.data_source.history, self.prediction_lead, now_ms=time.time() * 1000
+        )
+        if prediction is None:
+            return alert_level
+
+        # Only ever escalate
+        predicted_level = self.get_alert_level(prediction.predicted_value)
+        if self.bands.urgency[predicted_level] > self.bands.urgency[alert_level]:
+            return predicted_level
+        return alert_level
+
+    def create_classifier(self):
+        """Create the alert level stabilizer from the current settings"""
+        return AlertClassifier(
+            self.get_alert_level,
+            self.bands.order,
+            self.bands.urgency,
+            margin=self.hysteresis_margin,
+            min_dwell=self.min_dwell,
+            smoothing=self.smoothing,
+        )
+
+    def classify_reading(self, glucose):
+        """Get the alert level for a new reading, with prediction and hysteresis"""
+        value = self.classifier.smooth(glucose.value, glucose.timestamp)
+        candidate = self.get_predicted_alert_level(value)
+        return self.classifier.update(candidate, value, glucose.timestamp)
+
+    def get_reading_alert_level(self, glucose):
+        """Get the alert level for a reading outside the monitoring loop
+
+        A reading the loop already classified keeps its level, so checking
+        by hand doesn't feed the same reading to the classifier twice.
+        """
+        if glucose.timestamp != self.last_reading_timestamp or self.current_status not in self.bands.by_name:
+            self.last_reading_timestamp = glucose.timestamp
+            self.scheduler.record_reading(glucose.timestamp, glucose.value, glucose.direction)
+            self.current_status = self.classify_reading(glucose)
+        return self.current_status
+
     def save_settings(self, widget):
         """Save settings including glucose thresholds"""
         try:
             self.tapo_email = self.email_input.value
             self.tapo_password = self.password_input.value
             self.tapo_ip = self.ip_input.value
+            self.push_enabled = self.push_switch.value
+            self.push_secret = self.push_secret_input.value.strip()
+            if self.push_enabled and not self.push_secret:
+                self.push_secret = self.generate_push_secret()
+                self.push_secret_input.value = self.push_secret
+            self.color_mode = "gradient" if self.gradient_switch.value else "bands"
+            self.client_effects = self.client_effects_switch.value
+            self.bulb_queue.effects.client_fallback = self.client_effects
+            nightscout_url = self.nightscout_input.value.strip()
             
-            # Save glucose thresholds
-            self.critical_low_threshold = int(self.critical_low_input.value)
-            self.low_threshold = int(self.low_input.value)
-            self.high_threshold = int(self.high_input.value)
+            # Save glucose thresholds, typed in the selected units
+            units = self.units_selection.value
+            self.critical_low_threshold = self.parse_glucose(self.critical_low_input.value, units)
+            self.low_threshold = self.parse_glucose(self.low_input.value, units)
+            self.high_threshold = self.parse_glucose(self.high_input.value, units)
             
             # Validate thresholds
             if not (0 <= self.critical_low_threshold < self.low_threshold < self.high_threshold):
                 self.show_alert("❌ Invalid thresholds! Must be: Critical Low < Low < High", is_error=True)
                 return
+
+            if units != self.glucose_units:
+                # Custom band bounds are stored in the display units, keep their meaning
+                if self.custom_bands:
+                    scale = BandTable.MGDL_PER_MMOL if units == "mg/dL" else 1 / BandTable.MGDL_PER_MMOL
+                    for band in self.custom_bands:
+                        if band.get("lower") is not None:
+                            band["lower"] = round(band["lower"] * scale, 1 if units == "mmol/L" else 0)
+                self.glucose_units = units
+                self.threshold_input_units = units
             
+            # Switch data source if the Nightscout URL changed
+            if nightscout_url != self.nightscout_url:
+                self.nightscout_url = nightscout_url
+                asyncio.create_task(self.switch_data_source())
+
             # Save to file
             self.save_settings_to_file()
+
+            # Apply the push receiver setting right away while monitoring
+            if self.is_monitoring:
+                asyncio.create_task(self.update_push_receiver())
+
+            # Reclassify the current reading with the new thresholds
+            self.rebuild_bands()
+            self.last_reading_timestamp = None
             
-            self.alert_status.text = self.t("alert_status", "Settings Saved!")
-            self.alert_status.style.color = self.colors["green"]
+            self.set_alert_status("Settings Saved!")
+            self.status_view.set("alert_color", self.colors["green"])
             self.show_alert("✅ " + self.t("settings_saved") + "\n" + self.t("threshold_saved"))
             
         except Exception as e:
             self.show_alert(f"❌ Error saving: {str(e)}", is_error=True)
     
+    async def on_exit(self):
+        """Close network resources before the app exits"""
+        self.is_monitoring = False
+        if self.monitoring_task:
+            self.monitoring_task.cancel()
+        if self.stream_task is not None:
+            self.stream_task.cancel()
+        await self.data_source.close()
+        await self.bulb_queue.close()
+        await self.tapo.close()
+        await self.alert_dispatcher.close()
+        if self.push_receiver is not None:
+            await self.push_receiver.stop()
+        if self.history_log is not None:
+            self.history_log.close()
+        return True
+
     def toggle_monitoring(self, widget):
         """Start/stop monitoring"""
         if self.is_monitoring:
@@ -1363,59 +4347,224 @@ Version 0.0.1 - Made with ❤️ for diabetes families
             return
             
         self.is_monitoring = True
+        self.last_reading_timestamp = None
         self.monitor_btn.text = self.t("stop_monitoring")
-        self.alert_status.text = self.t("alert_status", self.t("status_monitoring"))
-        self.alert_status.style.color = self.colors["green"]
+        self.set_alert_status("status_monitoring")
+        self.status_view.set("alert_color", self.colors["green"])
         self.show_alert("🟢 " + self.t("monitoring_started"))
         
         self.monitoring_task = asyncio.create_task(self._monitoring_loop())
+        self.update_stream()
+        asyncio.create_task(self.update_push_receiver())
     
     def stop_monitoring(self):
         """Stop monitoring"""
         self.is_monitoring = False
         self.monitor_btn.text = self.t("start_monitoring")
-        self.alert_status.text = self.t("alert_status", self.t("status_stopped")) 
-        self.alert_status.style.color = self.colors["orange"]
+        self.set_alert_status("status_stopped")
+        self.status_view.set("alert_color", self.colors["orange"])
         
         if self.monitoring_task:
             self.monitoring_task.cancel()
+        self.log_stats()
+        self.stats_logged_at = None
+        # Alert again straight away when monitoring restarts
+        self.alert_dispatcher.reset()
+        # A client-driven flash would otherwise keep sending commands
+        self.bulb_queue.stop_effects()
+
+        # Release the stream, pooled connections and the push port while idle
+        self.update_stream()
+        asyncio.create_task(self.data_source.close())
+        asyncio.create_task(self.update_push_receiver())
     
-    async def update_bulb_color(self, glucose_value):
-        """Update bulb color based on customizable thresholds"""
-        if not self.tapo_device or not self.bulb_is_on:
-            return
+    def get_stats(self):
+        """Collect the statistics of the data source, bulb and UI components"""
+        stats = {
+            "polling": dict(self.poll_stats),
+            "data_source": self.data_source.get_stats(),
+            "bulb": self.tapo.get_stats(),
+            "bulb_queue": self.bulb_queue.get_stats(),
+            "bulb_effects": self.bulb_queue.effects.get_stats(),
+            "classifier": dict(self.classifier.stats),
+            "alerts": self.alert_dispatcher.get_stats(),
+            "status_view": self.status_view.get_stats(),
+            "status_icons": self.icon_renderer.get_stats(),
+        }
+        if self.push_receiver is not None:
+            stats["push_receiver"] = dict(self.push_receiver.stats)
+        return stats
+
+    def log_stats(self):
+        """Print the statistics, one line per component"""
+        try:
+            for name, component_stats in self.get_stats().items():
+                values = ", ".join(
+                    f"{key}={value:.3g}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in component_stats.items()
+                )
+                print(f"Stats {name}: {values}")
+        except Exception as e:
+            print(f"Error collecting stats: {e}")
+
+    async def update_bulb_color(self, glucose_value, alert_level=None, priority=None):
+        """Update bulb color based on customizable thresholds
+
+        The command is only queued. The queue connects to the bulb when it
+        sends it, within its send timeout, and the bulb status shows how that
+        went. Returns the command's future, or None if nothing was queued.
+        """
+        if not self.bulb_is_on or not all([self.tapo_email, self.tapo_password, self.tapo_ip]):
+            return None
             
         try:
-            alert_level = self.get_alert_level(glucose_value)
-            color_map = {
-                "critical": (0, 100),      # Red for critical low
-                "low": (270, 100),         # Light Pink for low
-                "normal": (120, 100),      # Green for normal
-                "high": (60, 100)          # Yellow for high
-            }
-            hue, saturation = color_map.get(alert_level, (120, 100))
-            await self.tapo_device.set_hue_saturation(hue, saturation)
+            self.tapo.configure(self.tapo_email, self.tapo_password, self.tapo_ip)
+            alert_level = alert_level or self.get_alert_level(glucose_value)
+            band = self.bands.by_name.get(alert_level) or self.get_normal_band()
+            if self.color_mode == "gradient":
+                hue, saturation = self.bands.gradient_color(self.get_gradient_value(glucose_value))
+            else:
+                hue, saturation = band.hue, band.saturation
+            if priority is None:
+                priority = self.get_bulb_priority(band)
+            # Queued by priority, only the latest color reaches the bulb
+            if band.effect in BulbEffects.EFFECTS:
+                future = self.bulb_queue.set_effect(band.effect, hue, saturation, band.brightness, priority=priority)
+            else:
+                future = self.bulb_queue.set_color(hue, saturation, band.brightness, priority=priority)
+            future.add_done_callback(self.show_bulb_command_result)
+            return future
         except Exception as e:
             print(f"Error updating bulb: {e}")
+            return None
+
+    def show_bulb_command_result(self, future):
+        """Show whether a queued bulb command reached the bulb"""
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.set_bulb_status("bulb_failed")
+            self.status_view.set("bulb_color", self.colors["red"])
+        elif future.result() is not None:
+            # Sent, or the bulb already showed it. Superseded commands say nothing
+            self.set_bulb_status("bulb_connected")
+            self.status_view.set("bulb_color", self.colors["green"])
     
+    def get_bulb_priority(self, band):
+        """Get the command queue priority for showing a band on the bulb"""
+        if not band.urgency:
+            return BulbCommandQueue.ROUTINE
+        if band.urgency >= max(self.bands.urgency.values()):
+            return BulbCommandQueue.CRITICAL
+        return BulbCommandQueue.ALERT
+
+    def get_gradient_value(self, glucose_value):
+        """Get the value the gradient color is taken from, shifted along the trend"""
+        if not self.gradient_trend:
+            return glucose_value
+        prediction = self.predictor.fit(
+            self.data_source.history, self.gradient_trend, now_ms=time.time() * 1000
+        )
+        if prediction is None:
+            return glucose_value
+        return prediction.predicted_value
+
+    async def process_reading(self, glucose):
+        """Run a reading through classification, UI and bulb updates
+
+        Returns False without doing anything if the reading was already processed.
+        """
+        if glucose.timestamp == self.last_reading_timestamp:
+            self.poll_stats["skipped"] += 1
+            return False
+        self.last_reading_timestamp = glucose.timestamp
+        self.poll_stats["processed"] += 1
+
+        self.scheduler.record_reading(glucose.timestamp, glucose.value, glucose.direction)
+        alert_level = self.classify_reading(glucose)
+        self.update_status(glucose.value, glucose.direction, alert_level)
+
+        # Queued without waiting for the bulb, which connects on its own
+        # schedule. The bulb shadow skips the command if the color is unchanged.
+        await self.update_bulb_color(glucose.value, alert_level)
+        return True
+
+    def generate_push_secret(self):
+        """Make a random secret for xDrip+ uploads"""
+        return secrets.token_hex(8)
+
+    async def update_push_receiver(self):
+        """Start or stop the push receiver to match the settings"""
+        should_run = self.is_monitoring and self.push_enabled
+        if should_run and not self.push_secret:
+            # Settings from before secrets were required
+            self.push_secret = self.generate_push_secret()
+            self.save_settings_to_file()
+        try:
+            if self.push_receiver is not None and (
+                not should_run
+                or self.push_receiver.port != self.push_port
+                or self.push_receiver.api_secret != self.push_secret
+            ):
+                await self.push_receiver.stop()
+                self.push_receiver = None
+            if should_run and self.push_receiver is None:
+                self.push_receiver = PushReceiver(
+                    self.handle_incoming_readings,
+                    port=self.push_port,
+                    api_secret=self.push_secret
+                )
+                await self.push_receiver.start()
+        except Exception as e:
+            self.push_receiver = None
+            print(f"Error starting push receiver: {e}")
+
+    async def handle_incoming_readings(self, readings):
+        """Feed pushed or streamed readings straight into the pipeline
+
+        The newest reading is processed in the background, so an upload is
+        answered and the stream keeps receiving without waiting for the bulb.
+        """
+        history = self.data_source.history
+        history.merge(readings)
+        if self.is_monitoring and history.latest() is not None:
+            asyncio.create_task(self._process_incoming_reading(history.latest()))
+
+    async def _process_incoming_reading(self, glucose):
+        """Process a pushed or streamed reading, reporting rather than raising errors"""
+        try:
+            await self.process_reading(glucose)
+        except Exception as e:
+            print(f"Error processing incoming reading: {e}")
+
+    def get_poll_delay(self):
+        """Get how long to wait before polling xDrip+ again"""
+        delay = self.scheduler.next_delay()
+        # Pushes and streams deliver new readings, polling is only a fallback for missed ones
+        if self.data_source.is_streaming or (
+            self.push_receiver is not None
+            and self.push_receiver.is_receiving(self.push_watchdog_interval)
+        ):
+            delay = max(delay, self.push_watchdog_interval)
+        return delay
+
     async def _monitoring_loop(self):
         """Main monitoring loop"""
-        last_glucose = None
-        
         while self.is_monitoring:
             try:
-                glucose = await self.xdrip_client.get_latest_glucose()
+                glucose = await self.data_source.get_latest_glucose()
                 
                 if glucose:
-                    alert_level = self.get_alert_level(glucose['value'])
-                    self.update_status(glucose['value'], glucose['direction'], alert_level)
-                    
-                    if not last_glucose or abs(glucose['value'] - last_glucose['value']) > 2:
-                        if await self.initialize_tapo() and self.bulb_is_on:
-                            await self.update_bulb_color(glucose['value'])
-                        last_glucose = glucose
+                    await self.process_reading(glucose)
+
+                now = time.time()
+                if self.stats_logged_at is None:
+                    self.stats_logged_at = now
+                elif now - self.stats_logged_at >= self.stats_log_interval:
+                    self.stats_logged_at = now
+                    self.log_stats()
                 
-                await asyncio.sleep(self.check_interval)
+                await asyncio.sleep(self.get_poll_delay())
                 
             except asyncio.CancelledError:
                 break
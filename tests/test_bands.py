@@ -0,0 +1,24 @@
+"""BandTable built from mmol/L band settings"""
+from diabuddybulb.app import BandTable
+
+SETTINGS = [
+    {"name": "low", "lower": None},
+    {"name": "normal", "lower": 3.9},
+    {"name": "high", "lower": 10.1},
+]
+
+
+def test_mmol_bounds_are_whole_mg_dl():
+    bands = BandTable.from_settings(SETTINGS, "mmol/L")
+    assert all(isinstance(threshold, int) for threshold in bands.thresholds)
+    assert bands.level_for(70) == "normal"
+    assert bands.level_for(69) == "low"
+
+
+def test_values_shown_as_the_bound_are_in_the_band():
+    for tenths in range(20, 300):
+        lower = tenths / 10
+        bands = BandTable.from_settings([{"name": "below", "lower": None}, {"name": "band", "lower": lower}], "mmol/L")
+        for mgdl in range(1, 600):
+            shown = round(mgdl / BandTable.MGDL_PER_MMOL, 1)
+            assert (bands.level_for(mgdl) == "band") == (shown >= lower), (lower, mgdl)
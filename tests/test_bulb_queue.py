@@ -0,0 +1,177 @@
+"""BulbCommandQueue and client-driven effects against a stand-in bulb"""
+import asyncio
+
+from diabuddybulb.app import BulbCommandQueue, BulbEffects, BulbShadow
+
+# The real effects with 10 ms steps, so frames run without slowing the tests
+FAST_EFFECTS = {name: (steps, 10) for name, (steps, step_time) in BulbEffects.EFFECTS.items()}
+
+
+class StandInBulb:
+    """TapoConnection stand-in for a bulb without light effects (like the L530E)"""
+    def __init__(self):
+        self.shadow = BulbShadow()
+        self.colors = []
+        self.brightness = []
+        self.power = []
+        self.color_sent = asyncio.Event()
+
+    async def set_effect(self, effect):
+        return None
+
+    async def set_color(self, hue, saturation, brightness=None):
+        self.colors.append((hue, saturation, brightness))
+        self.color_sent.set()
+        return True
+
+    async def set_power(self, is_on):
+        self.power.append(is_on)
+        return True
+
+    async def run(self, command):
+        class Device:
+            async def set_brightness(device, value):
+                self.brightness.append(value)
+        return await command(Device())
+
+    async def wait_for_colors(self, count):
+        """Wait until count colors (frames included) were sent"""
+        async def wait():
+            while len(self.colors) < count:
+                self.color_sent.clear()
+                await self.color_sent.wait()
+        await asyncio.wait_for(wait(), 5)
+
+
+def make_queue(bulb, frame_budget=20, **options):
+    effects = BulbEffects(
+        bulb, frame_interval=0.01, frame_budget=frame_budget, client_fallback=True, effects=FAST_EFFECTS
+    )
+    options.setdefault("min_interval", 0.01)
+    return BulbCommandQueue(bulb, effects=effects, **options)
+
+
+def test_color_during_client_flash_is_sent():
+    async def main():
+        bulb = StandInBulb()
+        bulb.shadow.apply(brightness=60)
+        queue = make_queue(bulb, budget=2)
+        assert await queue.set_effect("flash", 0, 100, 80, priority=BulbCommandQueue.CRITICAL)
+        # Let the frames run past what the queue's own budget allows
+        await bulb.wait_for_colors(queue.budget + 1)
+
+        result = await asyncio.wait_for(
+            queue.set_color(270, 100, priority=BulbCommandQueue.ALERT, timeout=5), 2
+        )
+        assert result is True
+        # Back to the brightness the bulb had before the flash
+        assert bulb.colors[-1] == (270, 100, 60)
+        # No more frames after the color
+        assert not queue.effects.is_running
+        await queue.close()
+
+    asyncio.run(main())
+
+
+def test_stop_effects_and_power_off_reach_the_bulb_during_a_flash():
+    async def main():
+        bulb = StandInBulb()
+        bulb.shadow.apply(brightness=60)
+        queue = make_queue(bulb)
+        await queue.set_effect("flash", 0, 100, 80, priority=BulbCommandQueue.CRITICAL)
+        await bulb.wait_for_colors(2)
+
+        assert await asyncio.wait_for(queue.stop_effects(), 2) is True
+        assert bulb.brightness == [60]
+
+        await queue.set_effect("flash", 0, 100, 80, priority=BulbCommandQueue.CRITICAL)
+        await bulb.wait_for_colors(len(bulb.colors) + 2)
+        assert await asyncio.wait_for(queue.set_power(False), 2) is True
+        assert bulb.power == [False]
+        assert not queue.effects.is_running
+        await queue.close()
+
+    asyncio.run(main())
+
+
+def test_unknown_brightness_is_left_alone_after_a_flash():
+    async def main():
+        bulb = StandInBulb()
+        queue = make_queue(bulb)
+        await queue.set_effect("flash", 0, 100, priority=BulbCommandQueue.CRITICAL)
+        await bulb.wait_for_colors(2)
+        assert await asyncio.wait_for(queue.set_color(120, 100), 2) is True
+        assert bulb.colors[-1] == (120, 100, None)
+        assert await asyncio.wait_for(queue.stop_effects(), 2) is False
+        assert bulb.brightness == []
+        await queue.close()
+
+    asyncio.run(main())
+
+
+def test_frames_have_their_own_allowance():
+    async def main():
+        bulb = StandInBulb()
+        queue = make_queue(bulb, frame_budget=2, min_interval=1.0)
+        await queue.set_effect("flash", 0, 100, 80, priority=BulbCommandQueue.CRITICAL)
+        # Two frames, then the steady color while the allowance is used up
+        await bulb.wait_for_colors(3)
+        assert queue.effects.stats["frames"] == 2
+        assert queue.get_wait(asyncio.get_running_loop().time()) <= queue.min_interval
+        await queue.close()
+
+    asyncio.run(main())
+
+
+def test_throttled_time_counts_only_time_spent_waiting():
+    async def main():
+        bulb = StandInBulb()
+        queue = BulbCommandQueue(bulb, budget=1, period=0.2, min_interval=0.01)
+        loop = asyncio.get_running_loop()
+        assert await queue.set_color(0, 100, 50)
+        started = loop.time()
+        # Each new color wakes the worker while it's throttled
+        for hue in range(10, 100, 10):
+            future = queue.set_color(hue, 100, 50)
+            await asyncio.sleep(0.01)
+        assert await future
+        elapsed = loop.time() - started
+        assert queue.stats["throttled_time"] <= elapsed + 0.05
+        await queue.close()
+
+    asyncio.run(main())
+
+
+def test_bulb_is_not_left_dim_while_frames_are_paused():
+    async def main():
+        bulb = StandInBulb()
+        queue = make_queue(bulb, frame_budget=4)
+        await queue.set_effect("flash", 0, 100, priority=BulbCommandQueue.CRITICAL)
+        await bulb.wait_for_colors(5)
+        # Four frames, ending on the dark one, then the steady color
+        assert [color[2] for color in bulb.colors] == [100, 1, 100, 1, 100]
+        assert bulb.colors[-1] == (0, 100, 100)
+        # Paused until the allowance comes back, a minute from the first frame
+        loop = asyncio.get_running_loop()
+        assert queue.effects.get_frame_wait(loop.time()) > 50
+        await asyncio.sleep(0.05)
+        assert len(bulb.colors) == 5
+        await queue.close()
+
+    asyncio.run(main())
+
+
+def test_same_effect_keeps_its_frames_running():
+    async def main():
+        bulb = StandInBulb()
+        queue = make_queue(bulb)
+        assert await queue.set_effect("flash", 0, 100, priority=BulbCommandQueue.CRITICAL)
+        frames_task = queue.effects._frames_task
+        # The next reading in the same band
+        assert await queue.set_effect("flash", 0, 100, priority=BulbCommandQueue.CRITICAL) is False
+        assert queue.effects._frames_task is frames_task
+        assert queue.effects.is_running
+        assert queue.stats["effects_halted"] == 0
+        await queue.close()
+
+    asyncio.run(main())
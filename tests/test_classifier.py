@@ -0,0 +1,74 @@
+"""AlertClassifier against readings hovering around the thresholds"""
+from diabuddybulb.app import AlertClassifier, BandTable
+
+BANDS = BandTable.from_thresholds(55, 70, 180)
+MINUTE = 60000
+
+
+def make_classifier(**options):
+    return AlertClassifier(BANDS.level_for, BANDS.order, BANDS.urgency, **options)
+
+
+def classify(classifier, values, interval=5, start=0):
+    """Feed one reading every interval minutes and get the levels shown"""
+    levels = []
+    for index, value in enumerate(values):
+        timestamp = start + index * interval * MINUTE
+        smoothed = classifier.smooth(value, timestamp)
+        levels.append(classifier.update(BANDS.level_for(smoothed), smoothed, timestamp))
+    return levels
+
+
+def test_escalates_immediately():
+    classifier = make_classifier()
+    assert classify(classifier, [100, 69, 54]) == ["normal", "low", "critical"]
+    assert classifier.stats == {"changes": 2, "suppressed": 0}
+
+
+def test_hovering_around_low_holds_the_level():
+    classifier = make_classifier()
+    levels = classify(classifier, [72, 69, 71, 70, 72, 69, 71])
+    assert levels == ["normal", "low", "low", "low", "low", "low", "low"]
+    # 71 and 72 are in range, but not by the margin
+    assert classifier.stats == {"changes": 1, "suppressed": 4}
+
+
+def test_hovering_around_high_holds_the_level():
+    classifier = make_classifier()
+    levels = classify(classifier, [175, 181, 179, 182, 178])
+    assert levels == ["normal", "high", "high", "high", "high"]
+    assert classifier.stats == {"changes": 1, "suppressed": 2}
+
+
+def test_recovery_waits_for_the_minimum_dwell():
+    classifier = make_classifier(min_dwell=10)
+    # Well clear of the margin, but only 5 minutes after going low
+    assert classify(classifier, [100, 65, 80, 80]) == ["normal", "low", "low", "normal"]
+    assert classifier.stats == {"changes": 2, "suppressed": 1}
+
+
+def test_recovery_past_the_margin_after_the_dwell():
+    classifier = make_classifier(min_dwell=0)
+    assert classify(classifier, [65, 72, 73]) == ["low", "low", "normal"]
+    assert classifier.stats == {"changes": 1, "suppressed": 1}
+
+
+def test_smoothing_damps_a_single_dip():
+    classifier = make_classifier(smoothing=0.5)
+    assert classify(classifier, [90, 60, 90]) == ["normal", "normal", "normal"]
+    assert classifier.smoothed_value == 82.5
+
+
+def test_smoothing_restarts_after_a_gap():
+    classifier = make_classifier(smoothing=0.5)
+    classify(classifier, [150, 150])
+    # 20 minutes later the old average no longer applies
+    assert classifier.smooth(60, 25 * MINUTE) == 60
+
+
+def test_reset_forgets_the_level():
+    classifier = make_classifier()
+    classify(classifier, [65])
+    classifier.reset()
+    assert classify(classifier, [100], start=5 * MINUTE) == ["normal"]
+    assert classifier.stats["changes"] == 0
@@ -0,0 +1,184 @@
+"""NightscoutClient against a local stand-in Nightscout server"""
+import asyncio
+import json
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from diabuddybulb.app import GlucoseHistory, NightscoutClient, XDripClient
+
+
+def make_entries(count, newest_ms, interval_ms=300000):
+    """Nightscout sgv entries, newest first"""
+    return [
+        {"type": "sgv", "sgv": 100 + index, "date": newest_ms - index * interval_ms, "direction": "Flat"}
+        for index in range(count)
+    ]
+
+
+class StandInNightscout:
+    """Serves /api/v1/entries/sgv.json from a list and a socket.io websocket"""
+    def __init__(self, entries, token="reader-abc"):
+        self.entries = entries
+        self.token = token
+        self.status = 200
+        self.requests = []
+        self.stream_updates = []
+        self.authorize = None
+        self.handshake = {"sid": "stand-in", "pingInterval": 25000}
+        # Stop answering after the updates without closing (a half-open connection)
+        self.go_silent = False
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api/v1/entries/sgv.json", self.handle_entries)
+        app.router.add_get("/socket.io/", self.handle_socket)
+        return app
+
+    async def handle_entries(self, request):
+        self.requests.append(dict(request.query))
+        if self.status != 200:
+            return web.json_response({"message": "error"}, status=self.status)
+        if request.query.get("token") != self.token:
+            return web.json_response({"message": "Unauthorized"}, status=401)
+        entries = self.entries
+        if "find[date][$gt]" in request.query:
+            newer_than = int(request.query["find[date][$gt]"])
+            entries = [entry for entry in entries if entry["date"] > newer_than]
+        if "find[date][$lt]" in request.query:
+            older_than = int(request.query["find[date][$lt]"])
+            entries = [entry for entry in entries if entry["date"] < older_than]
+        return web.json_response(entries[:int(request.query.get("count", 10))])
+
+    async def handle_socket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_str("0" + json.dumps(self.handshake))
+        async for message in ws:
+            data = message.data
+            if data == "40":
+                await ws.send_str("40")
+            elif data.startswith("42"):
+                event = json.loads(data[2:])
+                if event[0] == "authorize":
+                    self.authorize = event[1]
+                    await ws.send_str("42" + json.dumps(["connected"]))
+                    await ws.send_str("2")
+            elif data == "3":
+                # Ping answered, send the updates and hang up
+                for update in self.stream_updates:
+                    await ws.send_str("42" + json.dumps(["dataUpdate", update]))
+                if not self.go_silent:
+                    await ws.close()
+        return ws
+
+
+def run_with_server(stand_in, test):
+    async def main():
+        server = TestServer(stand_in.app())
+        await server.start_server()
+        try:
+            await test(str(server.make_url("")).rstrip("/"))
+        finally:
+            await server.close()
+    asyncio.run(main())
+
+
+def test_rest_pages_back_to_the_last_reading():
+    now = int(time.time() * 1000)
+    previous = now - 300000
+    stand_in = StandInNightscout(make_entries(10, previous))
+
+    async def test(url):
+        client = NightscoutClient(f"{url}/?token=reader-abc", page_size=4)
+        try:
+            latest = await client.get_latest_glucose()
+            assert latest.timestamp == previous
+            assert len(client.history) == 10
+            assert client.stats["pages"] == 3
+
+            # Only readings newer than the last one are asked for
+            stand_in.entries = make_entries(1, now) + stand_in.entries
+            latest = await client.get_latest_glucose()
+            assert latest.timestamp == now
+            assert stand_in.requests[-1]["find[date][$gt]"] == str(previous)
+        finally:
+            await client.close()
+
+    run_with_server(stand_in, test)
+
+
+def test_rest_failure_returns_none_even_with_history():
+    now = int(time.time() * 1000)
+    stand_in = StandInNightscout(make_entries(3, now))
+
+    async def test(url):
+        client = NightscoutClient(f"{url}/?token=reader-abc")
+        try:
+            assert await client.get_latest_glucose() is not None
+            for status in (401, 500):
+                stand_in.status = status
+                assert await client.get_latest_glucose() is None
+
+            stand_in.status = 200
+            client.token = "wrong-token"
+            assert await client.get_latest_glucose() is None
+        finally:
+            await client.close()
+
+    run_with_server(stand_in, test)
+
+
+def test_socket_io_stream_delivers_updates():
+    now = int(time.time() * 1000)
+    stand_in = StandInNightscout([])
+    stand_in.stream_updates = [{"sgvs": [{"mgdl": 142, "mills": now, "direction": "FortyFiveUp"}]}]
+
+    async def test(url):
+        client = NightscoutClient(f"{url}/?token=reader-abc", api_secret="secret")
+        received = []
+
+        async def on_readings(readings):
+            received.extend(readings)
+
+        try:
+            assert await client._stream_once(on_readings)
+        finally:
+            await client.close()
+        assert stand_in.authorize["token"] == "reader-abc"
+        assert stand_in.authorize["secret"] == client._hashed_secret()
+        assert [(reading.timestamp, reading.value) for reading in received] == [(now, 142)]
+        assert client.stats["stream_updates"] == 1
+
+    run_with_server(stand_in, test)
+
+
+def test_silent_stream_times_out_from_the_handshake():
+    now = int(time.time() * 1000)
+    stand_in = StandInNightscout([])
+    stand_in.handshake = {"sid": "stand-in", "pingInterval": 200, "pingTimeout": 100}
+    stand_in.go_silent = True
+    stand_in.stream_updates = [{"sgvs": [{"mgdl": 142, "mills": now, "direction": "Flat"}]}]
+
+    async def test(url):
+        client = NightscoutClient(f"{url}/?token=reader-abc")
+
+        async def on_readings(readings):
+            assert client.is_streaming
+
+        try:
+            assert await asyncio.wait_for(client._stream_once(on_readings), 5)
+        finally:
+            await client.close()
+        assert not client.is_streaming
+        assert client.stats["stream_updates"] == 1
+        assert client.stats["stream_timeouts"] == 1
+
+    run_with_server(stand_in, test)
+
+
+def test_sources_keep_an_empty_shared_history():
+    history = GlucoseHistory()
+    assert XDripClient(history=history).history is history
+    assert NightscoutClient("https://ns.example.com", history=history).history is history
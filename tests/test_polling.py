@@ -0,0 +1,41 @@
+"""ReadingScheduler with the RiskPollingPolicy against a simulated sensor"""
+from diabuddybulb.app import BandTable, PollingPolicy, ReadingScheduler, RiskPollingPolicy
+
+BANDS = BandTable.from_thresholds(55, 70, 180)
+
+
+def count_polls(values, policy=None, upload_lag=20, reading_interval=300):
+    """Poll for an hour of readings and count the polls
+
+    values(index) gives the reading the sensor takes at index * reading_interval,
+    which the server has upload_lag seconds later.
+    """
+    now = 0.0
+    scheduler = ReadingScheduler(clock=lambda: now, policy=policy or RiskPollingPolicy(lambda: BANDS))
+    polls = 0
+    latest = None
+    while now < 3600:
+        polls += 1
+        available = int((now - upload_lag) // reading_interval)
+        if available >= 0 and available != latest:
+            latest = available
+            scheduler.record_reading(available * reading_interval * 1000, values(available), "Flat")
+        now += scheduler.next_delay()
+    return polls
+
+
+def test_flat_out_of_range_keeps_the_reading_cadence():
+    baseline = count_polls(lambda index: 250, PollingPolicy())
+    assert count_polls(lambda index: 250) == baseline
+    assert count_polls(lambda index: 62) == baseline
+
+
+def test_stable_in_range_skips_readings():
+    assert count_polls(lambda index: 120) < count_polls(lambda index: 120, PollingPolicy())
+
+
+def test_falling_towards_low_only_retries_around_each_reading():
+    baseline = count_polls(lambda index: 100 - 3 * index, PollingPolicy())
+    polls = count_polls(lambda index: 100 - 3 * index)
+    # Catches readings sooner, but nowhere near polling every 30 seconds
+    assert baseline < polls <= 2 * baseline
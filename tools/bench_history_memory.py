@@ -0,0 +1,96 @@
+"""Measure the memory used to hold the glucose history
+
+Parses a batch of typical xDrip+ sgv.json entries and compares, with
+tracemalloc, keeping them as per-reading dicts with the raw payload
+against storing them in a GlucoseHistory:
+
+    python tools/bench_history_memory.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from diabuddybulb.app import GlucoseHistory, Reading  # noqa: E402
+
+
+def make_payload(count, interval):
+    """Build an sgv.json response body, newest entry first"""
+    now_ms = int(time.time() * 1000)
+    entries = []
+    for index in range(count):
+        timestamp = now_ms - index * interval * 1000
+        entries.append({
+            "_id": f"{timestamp:024x}",
+            "device": "xDrip-DexcomG6",
+            "date": timestamp,
+            "dateString": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp / 1000)),
+            "sgv": 100 + index % 80,
+            "delta": 1.5,
+            "direction": "Flat",
+            "type": "sgv",
+            "filtered": 120000,
+            "unfiltered": 120000,
+            "rssi": 100,
+            "noise": 1,
+            "sysTime": "2026-01-01T00:00:00.000Z",
+        })
+    return json.dumps(entries)
+
+
+def measure(build):
+    """Get the bytes still allocated by what build() returns"""
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def as_dicts(payload):
+    return [
+        {
+            "timestamp": entry["date"],
+            "value": entry["sgv"],
+            "direction": entry.get("direction", "Unknown"),
+            "raw_data": entry,
+        }
+        for entry in json.loads(payload)
+    ]
+
+
+def as_history(payload):
+    history = GlucoseHistory()
+    history.merge(
+        Reading(entry["date"], entry["sgv"], entry.get("direction", "Unknown"))
+        for entry in json.loads(payload)
+    )
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, default=288, help="number of readings to hold")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between readings")
+    args = parser.parse_args()
+
+    payload = make_payload(args.readings, args.interval)
+    dict_bytes = measure(lambda: as_dicts(payload))
+    history_bytes = measure(lambda: as_history(payload))
+    empty = GlucoseHistory()
+    slot_bytes = empty.timestamps.itemsize + empty.values.itemsize + empty.directions.itemsize
+
+    print(f"{args.readings} readings")
+    print(f"dicts with raw_data: {dict_bytes} bytes ({dict_bytes / args.readings:.0f} per reading)")
+    print(f"GlucoseHistory: {history_bytes} bytes ({history_bytes / args.readings:.0f} per reading, "
+          f"{slot_bytes} per slot)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Time status icon rendering
+
+Renders every band icon with a spread of values and trend arrows, cold and
+then again from the LRU cache, and prints the render time statistics.
+Needs Pillow:
+
+    python tools/bench_status_icons.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from diabuddybulb.app import BandTable, StatusIconRenderer  # noqa: E402
+
+
+async def run(count):
+    renderer = StatusIconRenderer(os.path.join(ROOT, "src", "diabuddybulb"), capacity=count)
+    if not renderer.available:
+        sys.exit("Pillow is not installed")
+    bands = BandTable.from_thresholds(54, 70, 180)
+    arrows = list(StatusIconRenderer.ARROWS)
+    keys = []
+    for index in range(count):
+        value = 40 + index * 7 % 300
+        band = bands.band_for(value)
+        keys.append((band.name, str(value), arrows[index % len(arrows)], band.icon))
+
+    started = time.perf_counter()
+    for name, value, arrow, icon in keys:
+        await renderer.render((name, value, arrow), icon)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for name, value, arrow, icon in keys:
+        renderer.get((name, value, arrow))
+    cached = time.perf_counter() - started
+
+    stats = renderer.get_stats()
+    print(f"{count} icons")
+    print(f"render: {cold / count * 1000:.2f} ms average, {stats['max_render_time'] * 1000:.2f} ms max")
+    print(f"cached: {cached / count * 1e6:.2f} us average")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200, help="number of distinct icons to render")
+    args = parser.parse_args()
+    asyncio.run(run(args.count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Time trend fits over the glucose history
+
+Fills a history with a day of synthetic readings and times
+TrendPredictor.fit() on it, the work done for every new reading:
+
+    python tools/bench_trend_fit.py
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from diabuddybulb.app import GlucoseHistory, Reading, TrendPredictor  # noqa: E402
+
+
+def make_history(hours, interval):
+    """Build a history of sine wave readings ending now"""
+    history = GlucoseHistory()
+    now_ms = int(time.time() * 1000)
+    count = int(hours * 3600 // interval)
+    history.merge(
+        Reading(now_ms - index * interval * 1000, int(130 + 60 * math.sin(index / 20)), "Flat")
+        for index in range(count)
+    )
+    return history, now_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fits", type=int, default=100000, help="number of fits to time")
+    parser.add_argument("--hours", type=float, default=24, help="hours of readings in the history")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between readings")
+    args = parser.parse_args()
+
+    history, now_ms = make_history(args.hours, args.interval)
+    predictor = TrendPredictor()
+    if predictor.fit(history, now_ms=now_ms) is None:
+        sys.exit("Too few recent readings to fit")
+
+    started = time.perf_counter()
+    for _ in range(args.fits):
+        predictor.fit(history, now_ms=now_ms)
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(history)} readings, {args.fits} fits")
+    print(f"fit: {elapsed / args.fits * 1e6:.2f} us average")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Build the status icons shipped with the app
+
+The full size artwork lives in assets/status_icons. The app only shows the
+status icon at 80x80 (dp), so this writes copies sized for the densest
+screens we target into src/diabuddybulb, where Briefcase picks them up.
+
+Run it after changing the artwork (needs Pillow):
+
+    python tools/resize_status_icons.py
+"""
+import argparse
+import os
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(ROOT, "assets", "status_icons")
+OUTPUT_DIR = os.path.join(ROOT, "src", "diabuddybulb")
+
+# Size of the status ImageView in the app
+DISPLAY_SIZE = 80
+# xxhdpi screens draw 3 pixels per dp
+DEFAULT_SCALE = 3
+
+
+def resize_icon(source, destination, size):
+    """Write a size x size copy of an icon"""
+    with Image.open(source) as image:
+        image = image.convert("RGBA")
+        image.thumbnail((size, size), Image.LANCZOS)
+        image.save(destination, optimize=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=DEFAULT_SCALE,
+                        help="pixels per dp of the densest screen to support")
+    args = parser.parse_args()
+
+    size = DISPLAY_SIZE * args.scale
+    for name in sorted(os.listdir(SOURCE_DIR)):
+        if not name.endswith(".png"):
+            continue
+        source = os.path.join(SOURCE_DIR, name)
+        destination = os.path.join(OUTPUT_DIR, name)
+        resize_icon(source, destination, size)
+        print(f"{name}: {os.path.getsize(source)} -> {os.path.getsize(destination)} bytes ({size}x{size})")
+
+
+if __name__ == "__main__":
+    main()